@@ -1,24 +1,60 @@
 import io
+import re
 import time
-import pyautogui
+import json
+import struct
+import hashlib
+import argparse
+import tempfile
+import uuid
+import atexit
+import multiprocessing
+from multiprocessing import shared_memory
+import importlib
 import subprocess
+import signal
 import platform
-import cv2
+import ctypes
 import logging
 from flask import Flask, Response, request, jsonify, render_template_string, send_from_directory
-from PIL import ImageGrab
-import tkinter as tk
-from threading import Thread
-from queue import Queue
-import psutil
+from werkzeug.serving import WSGIRequestHandler
+from werkzeug.wsgi import LimitedStream
+from threading import Thread, Lock, Condition, Event, current_thread
+from queue import Queue, LifoQueue, Empty, Full
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import os
+import sys
+import http.client
+from urllib.parse import urlparse, quote
+
+
+class LazyModule:
+    # 首次访问属性时才导入模块，避免启动时加载摄像头、图形界面等重量级依赖
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+
+cv2 = LazyModule('cv2')
+np = LazyModule('numpy')
+psutil = LazyModule('psutil')
+pyautogui = LazyModule('pyautogui')
+tk = LazyModule('tkinter')
+Image = LazyModule('PIL.Image')
+ImageDraw = LazyModule('PIL.ImageDraw')
+ImageGrab = LazyModule('PIL.ImageGrab')
 
 # 配置日志记录
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-camera_status_queue = Queue()
 
 # 创建一个目录用于存储上传的文件
 UPLOAD_FOLDER = 'uploads'
@@ -35,84 +71,863 @@ SCREEN_RESOLUTION_SCALE = 0.7  # 分辨率缩放因子
 CAMERA_RESOLUTION_SCALE = 0.7
 IS_MOBILE_MODE = False
 IS_CLIENT_HIDDEN = False
+HYBRID_SCREEN_ENCODING = True  # 按图块区分文字/图像区域，分别使用无损和JPEG编码
+TILE_SIZE = 128  # 混合编码图块边长(像素)
+TILE_PALETTE_MAX_COLORS = 256  # 颜色数不超过该值的图块视为文字/界面区域
+TILE_CACHE_MAX_ENTRIES = 4096  # 图块编码缓存的最大条目数
+TILE_KEEPALIVE_SECONDS = 1  # 画面无变化时发送空消息的间隔，用于及时发现已断开的客户端
+CURSOR_SAMPLE_RATE = 60  # 光标位置采样频率(次/秒)，与屏幕帧率无关
+CURSOR_KEEPALIVE_SECONDS = 15  # 光标长时间不动时发送保活注释的间隔(秒)
+SCREEN_VIEWPORT = None  # 未指定查看区域的屏幕流使用的默认区域 (x, y, 宽, 高)，None 表示整个主屏幕
+CAMERA_IDLE_RELEASE_SECONDS = 30  # 最后一个观看者离开后保留摄像头的时间(秒)
+CAMERA_IDLE_FRAME_RATE = 1  # 画面静止时摄像头视频流的帧率
+MOTION_DETECTION_ENABLED = True  # 按画面运动情况在完整帧率和静止帧率之间切换
+MOTION_CHECK_RATE = 10  # 画面静止时检测运动的频率(次/秒)
+MOTION_PIXEL_THRESHOLD = 25  # 灰度差超过该值的像素视为变化，用于过滤传感器噪声
+MOTION_AREA_THRESHOLD = 0.01  # 变化像素所占比例超过该值视为有运动
+MOTION_HOLD_SECONDS = 3  # 运动停止后保持完整帧率的时间(秒)
+MOTION_EVENT_HISTORY = 200  # 保留的运动事件数量
+LATENCY_PROBE_TIMEOUT = 5  # 延迟探测等待画面变化的最长时间(秒)
+LATENCY_PROBE_REGION_SIZE = 32  # 点击探测时检测画面变化的区域边长(像素)
+LATENCY_PROBE_MAX_PENDING = 16  # 同时等待画面变化的探测数上限，超出时丢弃最早的探测
+LATENCY_HISTOGRAM_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)  # 延迟直方图分桶上限(毫秒)
+SERVER_PORT = 5000
+DELTA_BLOCK_SIZE = 64 * 1024  # 增量同步的默认分块大小(字节)
+SIGNATURE_CACHE_MAX_ENTRIES = 64  # 文件分块校验和缓存的最大文件数
+BATCH_MAX_WORKERS = 8  # 批量命令同时运行的最大进程数(所有任务共享)
+BATCH_MAX_JOBS = 100  # 结果存储中保留的最大任务数，超出时丢弃最早完成的任务
+BATCH_DEFAULT_TIMEOUT = 60  # 批量命令的默认超时时间(秒)
+BATCH_OUTPUT_LIMIT = 64 * 1024  # 每条命令保存的标准输出/标准错误的最大字符数
+FRAME_BUS_SLOT_BYTES = 3840 * 2160 * 3  # 共享内存帧总线输入环每个槽位的容量(字节)，超过该大小的帧在服务进程内编码
+FRAME_BUS_OUTPUT_SLOT_BYTES = 4 * 1024 * 1024  # 输出环每个槽位的容量(字节)，编码结果超过该大小时在服务进程内重新编码
+frame_bus = None  # 多进程编码模式下的共享内存帧总线
+GATEWAY_POOL_SIZE = 4  # 网关到每个被控端保持的空闲持久连接数
+GATEWAY_THUMBNAIL_SCALE = 0.2  # 网关缩略图相对屏幕的缩放比例
+GATEWAY_THUMBNAIL_QUALITY = 40
+GATEWAY_THUMBNAIL_INTERVAL = 2  # 缩略图刷新间隔(秒)
+GATEWAY_RETRY_SECONDS = 3  # 上游流断开后重新连接的等待时间(秒)
+GATEWAY_KEEPALIVE_SECONDS = 15  # 转发的流没有新消息时写出保活数据的间隔(秒)
+GATEWAY_REQUEST_TIMEOUT = 30  # 网关转发普通请求时等待被控端的超时时间(秒)
+# 可能长时间运行的路由单独设置等待被控端的超时时间(秒)
+GATEWAY_ROUTE_TIMEOUTS = {
+    'execute_command': 3600,
+    'upload_file': 3600,
+    'upload_signature': 600,
+    'upload_delta': 3600
+}
+GATEWAY_BUFFER_BYTES = 1024 * 1024  # 不超过该大小的请求体在网关内缓存(失败时可重试)，更大的请求体边收边转发
+# 网关对每个被控端只订阅一次、再分发给所有操作者的流及其类型
+GATEWAY_FANOUT_ROUTES = {
+    'video_stream': 'multipart/x-mixed-replace; boundary=frame',
+    'camera_stream': 'multipart/x-mixed-replace; boundary=frame',
+    'cursor_stream': 'text/event-stream',
+    'snapshot_stream': 'multipart/x-mixed-replace; boundary=frame'
+}
 root = None
 
 
+class MotionDetector:
+    # 在缩小到 64x48 并模糊后的灰度图上与缓慢更新的背景比较，过滤传感器噪声和缓慢的光线变化
+    def __init__(self):
+        self.lock = Lock()
+        self.background = None
+        self.active = False
+        self.score = 0.0
+        self.last_motion = None
+        self.events = deque(maxlen=MOTION_EVENT_HISTORY)
+
+    def update(self, frame):
+        small = cv2.resize(frame, (64, 48), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0).astype(np.float32)
+        if self.background is None:
+            self.background = gray
+            return self.active
+        score = float((cv2.absdiff(gray, self.background) > MOTION_PIXEL_THRESHOLD).mean())
+        cv2.accumulateWeighted(gray, self.background, 0.05)
+        now = time.time()
+        with self.lock:
+            self.score = score
+            if score >= MOTION_AREA_THRESHOLD:
+                self.last_motion = now
+                if not self.active:
+                    self.active = True
+                    self.events.append({'start': now, 'end': None, 'peak_score': score})
+                    logger.info("摄像头画面检测到运动")
+                else:
+                    self.events[-1]['peak_score'] = max(self.events[-1]['peak_score'], score)
+            elif self.active and now - self.last_motion >= MOTION_HOLD_SECONDS:
+                self.active = False
+                self.events[-1]['end'] = self.last_motion
+                logger.info("摄像头画面恢复静止")
+            return self.active
+
+    def reset(self):
+        # 摄像头重新打开后重新建立背景，并结束未结束的运动事件
+        with self.lock:
+            self.background = None
+            if self.active:
+                self.active = False
+                self.events[-1]['end'] = self.last_motion
+
+    def to_dict(self, since=None):
+        with self.lock:
+            return {
+                'enabled': MOTION_DETECTION_ENABLED,
+                'active': self.active,
+                'score': round(self.score, 4),
+                'last_motion': self.last_motion,
+                'events': [dict(event) for event in self.events
+                           if since is None or (event['end'] or time.time()) >= since]
+            }
+
+
 class CameraProcessor:
+    # 摄像头在第一个观看者连接时才打开，由一个采集线程读取和编码画面并分发给所有观看者；
+    # 最后一个观看者离开后保留 CAMERA_IDLE_RELEASE_SECONDS 秒，之后释放摄像头
     def __init__(self):
         self.camera = None
+        self.status = "摄像头未启用"
+        self.condition = Condition()
+        self.frame = None
+        self.sequence = 0
+        self.viewers = 0
+        self.idle_since = 0
+        self.thread = None
+        self.camera_factory = None
+        self.motion_detector = MotionDetector()
+        self.last_published = 0
+
+    def open_camera(self):
         try:
-            self.camera = cv2.VideoCapture(0)
+            self.camera = self.camera_factory() if self.camera_factory else cv2.VideoCapture(0)
             self.camera.set(cv2.CAP_PROP_FPS, CAMERA_FRAME_RATE)
-            status = "摄像头已打开" if self.camera.isOpened() else "摄像头未打开"
+            self.status = "摄像头已打开" if self.camera.isOpened() else "摄像头未打开"
         except Exception as error:
-            status = f"摄像头初始化出错: {error}"
+            self.status = f"摄像头初始化出错: {error}"
             self.camera = None
-        camera_status_queue.put(status)
-        logger.info(status)
+        logger.info(self.status)
+        return self.camera is not None and self.camera.isOpened()
 
-    def generate_camera_frames(self):
-        if not self.camera:
-            return
+    def close_camera(self):
+        if self.camera:
+            self.camera.release()
+            self.camera = None
+            self.status = "摄像头已释放"
+            logger.info("摄像头已释放")
+
+    def start(self):
+        with self.condition:
+            self.idle_since = time.time()
+            if self.thread is None:
+                self.thread = Thread(target=self._capture_frames, daemon=True)
+                self.thread.start()
+
+    def _capture_frames(self):
         try:
+            if not self.open_camera():
+                return
+            self.motion_detector.reset()
+            moving = True
             while True:
                 start_time = time.time()
-
-                success, frame = self.camera.read()
-                if success:
-                    # 调整分辨率
-                    if CAMERA_RESOLUTION_SCALE < 1.0:
-                        new_size = (int(frame.shape[1] * CAMERA_RESOLUTION_SCALE),
-                                    int(frame.shape[0] * CAMERA_RESOLUTION_SCALE))
-                        frame = cv2.resize(frame, new_size, interpolation=cv2.INTER_AREA)
-
-                    # 设置JPEG压缩参数
-                    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), DEFAULT_CAMERA_QUALITY]
-                    result, buffer = cv2.imencode('.jpg', frame, encode_param)
-
-                    yield (b'--frame\r\n'
-                           b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
-
-                else:
-                    logger.warning("无法读取摄像头帧")
-                    break
-
-                # 精确控制帧率
+                with self.condition:
+                    if self.viewers <= 0:
+                        if time.time() - self.idle_since >= CAMERA_IDLE_RELEASE_SECONDS:
+                            self.close_camera()
+                            self.thread = None
+                            return
+                        streaming = False
+                    else:
+                        streaming = True
+
+                if streaming:
+                    success, frame = self.camera.read()
+                    if not success:
+                        logger.warning("无法读取摄像头帧")
+                        break
+
+                    # 画面静止时只按 CAMERA_IDLE_FRAME_RATE 编码和发送
+                    moving = self.motion_detector.update(frame) if MOTION_DETECTION_ENABLED else True
+                    if moving or start_time - self.last_published >= 1.0 / CAMERA_IDLE_FRAME_RATE:
+                        self.last_published = start_time
+                        # 多进程编码模式下由编码工作进程缩放和压缩
+                        encoded = frame_bus.encode(frame, 'BGR', CAMERA_RESOLUTION_SCALE, DEFAULT_CAMERA_QUALITY) \
+                            if frame_bus else None
+                        if encoded is None:
+                            # 调整分辨率
+                            if CAMERA_RESOLUTION_SCALE < 1.0:
+                                new_size = (int(frame.shape[1] * CAMERA_RESOLUTION_SCALE),
+                                            int(frame.shape[0] * CAMERA_RESOLUTION_SCALE))
+                                frame = cv2.resize(frame, new_size, interpolation=cv2.INTER_AREA)
+
+                            # 设置JPEG压缩参数
+                            encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), DEFAULT_CAMERA_QUALITY]
+                            result, buffer = cv2.imencode('.jpg', frame, encode_param)
+                            encoded = buffer.tobytes()
+
+                        with self.condition:
+                            self.frame = encoded
+                            self.sequence += 1
+                            self.condition.notify_all()
+
+                # 精确控制帧率，画面静止时降低读取频率，只用于检测运动
+                frame_rate = CAMERA_FRAME_RATE if moving else min(MOTION_CHECK_RATE, CAMERA_FRAME_RATE)
                 elapsed = time.time() - start_time
-                sleep_time = max(0, (1.0 / CAMERA_FRAME_RATE) - elapsed)
+                sleep_time = max(0, (1.0 / frame_rate) - elapsed)
                 time.sleep(sleep_time)
 
         except Exception as error:
             logger.error(f"生成摄像头视频流出错: {error}")
         finally:
-            if self.camera:
-                self.camera.release()
-                logger.info("摄像头已释放")
+            with self.condition:
+                # 空闲退出时已释放摄像头并清空 self.thread，期间可能已有新的采集线程启动，不能关闭它的摄像头
+                if self.thread is current_thread():
+                    self.close_camera()
+                    self.thread = None
+                self.condition.notify_all()
+
+    def hold(self):
+        # 没有观看者时也保持摄像头打开，用于持续记录运动事件
+        with self.condition:
+            self.viewers += 1
+        self.start()
+
+    def generate_camera_frames(self):
+        with self.condition:
+            self.viewers += 1
+        self.start()
+        try:
+            sequence = self.sequence
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.sequence != sequence or self.thread is None, timeout=5)
+                    if self.sequence == sequence:
+                        if self.thread is None:
+                            return
+                        continue
+                    frame = self.frame
+                    sequence = self.sequence
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n'
+                       b'Content-Length: %d\r\n\r\n' % len(frame) + frame + b'\r\n')
+        finally:
+            with self.condition:
+                self.viewers -= 1
+                self.idle_since = time.time()
 
 
 camera_processor = CameraProcessor()
 
 
-def generate_screen_frames():
+class RECT(ctypes.Structure):
+    _fields_ = [('left', ctypes.c_long),
+                ('top', ctypes.c_long),
+                ('right', ctypes.c_long),
+                ('bottom', ctypes.c_long)]
+
+
+def list_monitors():
+    monitors = []
+    if platform.system() == 'Windows':
+        def collect_monitor(monitor, dc, rect, data):
+            monitors.append({'x': rect.contents.left, 'y': rect.contents.top,
+                             'width': rect.contents.right - rect.contents.left,
+                             'height': rect.contents.bottom - rect.contents.top})
+            return 1
+
+        monitor_enum_proc = ctypes.WINFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p,
+                                               ctypes.POINTER(RECT), ctypes.c_void_p)
+        ctypes.windll.user32.EnumDisplayMonitors(None, None, monitor_enum_proc(collect_monitor), 0)
+    if not monitors:
+        # 其他平台只能获取主屏幕尺寸
+        width, height = pyautogui.size()
+        monitors.append({'x': 0, 'y': 0, 'width': width, 'height': height})
+    return monitors
+
+
+def get_primary_viewport():
+    width, height = pyautogui.size()
+    return 0, 0, width, height
+
+
+def get_screen_viewport():
+    return SCREEN_VIEWPORT or get_primary_viewport()
+
+
+VIEWPORT_PARAMS = ('x', 'y', 'width', 'height')
+
+
+def parse_viewport(data):
+    # 解析客户端指定的查看区域: monitor 显示器编号，或 x/y/width/height；
+    # 区域裁剪到所有显示器组成的桌面范围内，参数无效或完全在桌面之外时抛出 ValueError
+    monitors = list_monitors()
+    if 'monitor' in data:
+        try:
+            index = int(data['monitor'])
+            if index < 0:
+                raise IndexError(index)
+            monitor = monitors[index]
+        except (ValueError, TypeError, IndexError):
+            raise ValueError(f"无效的显示器编号: {data['monitor']}")
+        return monitor['x'], monitor['y'], monitor['width'], monitor['height']
+    missing = [param for param in VIEWPORT_PARAMS if param not in data]
+    if missing:
+        raise ValueError(f"缺少必要参数: {', '.join(missing)}")
+    try:
+        x, y, width, height = (int(data[param]) for param in VIEWPORT_PARAMS)
+    except (ValueError, TypeError):
+        raise ValueError("查看区域参数必须为整数")
+    if width <= 0 or height <= 0:
+        raise ValueError("查看区域的宽和高必须为正整数")
+    left = max(x, min(monitor['x'] for monitor in monitors))
+    top = max(y, min(monitor['y'] for monitor in monitors))
+    right = min(x + width, max(monitor['x'] + monitor['width'] for monitor in monitors))
+    bottom = min(y + height, max(monitor['y'] + monitor['height'] for monitor in monitors))
+    if right <= left or bottom <= top:
+        raise ValueError("查看区域不在任何显示器范围内")
+    return left, top, right - left, bottom - top
+
+
+def request_viewport():
+    # 屏幕流的查询参数中指定了查看区域时使用该区域，否则使用默认区域；每个流的查看区域互不影响
+    if 'monitor' in request.args or any(param in request.args for param in VIEWPORT_PARAMS):
+        return parse_viewport(request.args)
+    return get_screen_viewport()
+
+
+class SyntheticDesktop:
+    # 合成桌面，提供与 pyautogui 和 ImageGrab 相同的接口，用于测试、延迟测量和压力测试；
+    # 每次点击在点击位置画一个色块，每次按键在底部输入框中写入一个字符
+    def __init__(self, width=1280, height=720):
+        self.width = width
+        self.height = height
+        self.lock = Lock()
+        self.cursor = (width // 2, height // 2)
+        self.marks = 0
+        self.caret = 10
+        self.image = Image.new('RGB', (width, height), (240, 240, 240))
+        draw = ImageDraw.Draw(self.image)
+        for line in range(0, height - 60, 20):
+            draw.text((10, line + 10), f"{line // 20:03d} 合成桌面 synthetic desktop - the quick brown fox jumps over the lazy dog",
+                      fill=(30, 30, 30))
+        draw.rectangle((0, height - 40, width, height), fill=(255, 255, 255), outline=(0, 0, 0))
+
+    def size(self):
+        return self.width, self.height
+
+    def position(self):
+        return self.cursor
+
+    def moveTo(self, x, y, *args, **kwargs):
+        self.cursor = (int(x), int(y))
+
+    def mouseDown(self, *args, **kwargs):
+        pass
+
+    def mouseUp(self, *args, **kwargs):
+        pass
+
+    def click(self, x=None, y=None, *args, **kwargs):
+        if x is not None and y is not None:
+            self.moveTo(x, y)
+        with self.lock:
+            self.marks += 1
+            color = ((self.marks * 67) % 256, (self.marks * 131) % 256, (self.marks * 199) % 256)
+            x, y = self.cursor
+            ImageDraw.Draw(self.image).rectangle((x - 6, y - 6, x + 6, y + 6), fill=color)
+
+    rightClick = click
+    doubleClick = click
+    dragTo = click
+
+    def press(self, key, *args, **kwargs):
+        with self.lock:
+            draw = ImageDraw.Draw(self.image)
+            if self.caret > self.width - 20:
+                draw.rectangle((1, self.height - 39, self.width - 1, self.height - 1), fill=(255, 255, 255))
+                self.caret = 10
+            draw.text((self.caret, self.height - 28), str(key)[:1], fill=(0, 0, 0))
+            self.caret += 10
+
+    def grab(self, bbox=None, **kwargs):
+        with self.lock:
+            return self.image.crop(bbox) if bbox else self.image.copy()
+
+
+class SyntheticCamera:
+    # 合成摄像头，提供与 cv2.VideoCapture 相同的接口；每 20 秒中有 5 秒画面里有方块移动，其余时间静止，
+    # 画面带有模拟传感器噪声
+    def __init__(self, width=640, height=480):
+        self.width = width
+        self.height = height
+        self.started_at = time.time()
+        self.opened = True
+        self.background = np.full((height, width, 3), 90, dtype=np.uint8)
+        self.background[:, :, 1] = np.linspace(60, 180, width, dtype=np.uint8)
+        generator = np.random.default_rng(0)
+        self.noise = [generator.integers(-6, 7, (height, width, 1), dtype=np.int16) for _ in range(8)]
+        self.frames = 0
+
+    def set(self, *args):
+        return True
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        self.frames += 1
+        frame = np.clip(self.background + self.noise[self.frames % len(self.noise)], 0, 255).astype(np.uint8)
+        elapsed = (time.time() - self.started_at) % 20
+        if elapsed < 5:
+            x = int(elapsed / 5 * (self.width - 80))
+            frame[200:280, x:x + 80] = (240, 240, 240)
+        return True, frame
+
+    def release(self):
+        self.opened = False
+
+
+def use_synthetic_devices():
+    global pyautogui, ImageGrab
+    pyautogui = ImageGrab = SyntheticDesktop()
+    camera_processor.camera_factory = SyntheticCamera
+    logger.info("使用合成桌面和合成摄像头代替真实设备")
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+
+    def percentile(self, fraction):
+        # 以所在分桶的上限作为分位数的近似值
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        # 落在溢出分桶时返回溢出标签，而不是当作没有数据
+        return f">{self.buckets[-1]}"
+
+    def to_dict(self):
+        labels = [f"<={bound}" for bound in self.buckets] + [f">{self.buckets[-1]}"]
+        return {
+            'buckets': dict(zip(labels, self.counts)),
+            'count': self.count,
+            'avg': round(self.total / self.count, 2) if self.count else None,
+            'p50': self.percentile(0.5) if self.count else None,
+            'p90': self.percentile(0.9) if self.count else None,
+            'p99': self.percentile(0.99) if self.count else None
+        }
+
+
+class LatencyProbe:
+    # 从浏览器发出输入到画面变化被发送出去的端到端延迟，分阶段统计(毫秒):
+    # 请求传输、输入注入、等待截图、编码、发送
+    STAGES = ('request_transit', 'injection', 'capture_wait', 'encode', 'delivery', 'total')
+
+    def __init__(self):
+        self.lock = Lock()
+        self.pending = {}
+        self.recent = deque(maxlen=50)
+        self.timeouts = 0
+        self.histograms = {stage: LatencyHistogram() for stage in self.STAGES}
+
+    def begin(self, probe, received_at, region, viewport=None):
+        # 注入输入之前先截取探测区域作为基准画面；探测参数无效时放弃探测，输入照常注入
+        if not isinstance(probe, dict) or 'id' not in probe:
+            return None
+        try:
+            region = tuple(int(value) for value in probe.get('region', region))
+            x, y, width, height = region
+            if width <= 0 or height <= 0:
+                raise ValueError("探测区域的宽和高必须为正整数")
+            if viewport:
+                # 探测区域移入查看区域内，否则靠近边缘的点击在 check_frame 中永远无法比较，只会超时
+                view_x, view_y, view_width, view_height = viewport
+                width, height = min(width, view_width), min(height, view_height)
+                x = min(max(x, view_x), view_x + view_width - width)
+                y = min(max(y, view_y), view_y + view_height - height)
+                region = (x, y, width, height)
+            sent_at = probe.get('sent_at')
+            sent_at = float(sent_at) / 1000 if sent_at is not None else None
+            baseline = np.asarray(ImageGrab.grab(bbox=(x, y, x + width, y + height), all_screens=True).convert('RGB'))
+        except (TypeError, ValueError, OSError) as error:
+            logger.warning(f"忽略无效的延迟探测 {probe}: {error}")
+            return None
+        return {
+            'id': str(probe['id']),
+            'sent_at': sent_at,
+            'received_at': received_at,
+            'region': region,
+            'baseline': baseline,
+            'injection_started': time.time()
+        }
+
+    def injected(self, record):
+        if record is None:
+            return
+        record['injected_at'] = time.time()
+        with self.lock:
+            # 没有画面流时 check_frame 不会运行，这里清理超时的探测并限制数量，避免基准画面无限堆积
+            for probe_id, pending in list(self.pending.items()):
+                if record['injected_at'] - pending['injected_at'] > LATENCY_PROBE_TIMEOUT \
+                        or len(self.pending) >= LATENCY_PROBE_MAX_PENDING:
+                    del self.pending[probe_id]
+                    self.timeouts += 1
+            self.pending[record['id']] = record
+
+    def check_frame(self, image, origin, grabbed_at):
+        with self.lock:
+            if not self.pending:
+                return []
+            detected = []
+            for probe_id, record in list(self.pending.items()):
+                if grabbed_at - record['injected_at'] > LATENCY_PROBE_TIMEOUT:
+                    del self.pending[probe_id]
+                    self.timeouts += 1
+                    continue
+                x, y, width, height = record['region']
+                left, top = x - origin[0], y - origin[1]
+                if left < 0 or top < 0 or left + width > image.width or top + height > image.height:
+                    continue
+                patch = np.asarray(image.crop((left, top, left + width, top + height)).convert('RGB'))
+                if not np.array_equal(patch, record['baseline']):
+                    del self.pending[probe_id]
+                    record['grabbed_at'] = grabbed_at
+                    detected.append(record)
+            return detected
+
+    def mark_encoded(self, records):
+        encoded_at = time.time()
+        for record in records:
+            record['encoded_at'] = encoded_at
+
+    def mark_delivered(self, records):
+        delivered_at = time.time()
+        for record in records:
+            start = record['sent_at'] if record['sent_at'] is not None else record['received_at']
+            breakdown = {
+                'request_transit': record['received_at'] - record['sent_at'] if record['sent_at'] is not None else None,
+                'injection': record['injected_at'] - record['injection_started'],
+                'capture_wait': record['grabbed_at'] - record['injected_at'],
+                'encode': record['encoded_at'] - record['grabbed_at'],
+                'delivery': delivered_at - record['encoded_at'],
+                'total': delivered_at - start
+            }
+            breakdown = {stage: round(max(0.0, value) * 1000, 2) for stage, value in breakdown.items()
+                         if value is not None}
+            with self.lock:
+                for stage, value in breakdown.items():
+                    self.histograms[stage].observe(value)
+                self.recent.append(dict(breakdown, id=record['id']))
+
+    def reset(self):
+        with self.lock:
+            self.pending.clear()
+            self.recent.clear()
+            self.timeouts = 0
+            self.histograms = {stage: LatencyHistogram() for stage in self.STAGES}
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'histograms': {stage: histogram.to_dict() for stage, histogram in self.histograms.items()},
+                'recent': list(self.recent),
+                'pending': len(self.pending),
+                'timeouts': self.timeouts
+            }
+
+
+latency_probe = LatencyProbe()
+
+
+class SharedFrameRing:
+    # 共享内存环形缓冲区，每个槽位由 16 字节头部(帧序号、数据长度)和数据区组成；
+    # 读取方通过 view() 直接映射槽位内存，不需要复制或序列化
+    HEADER = struct.Struct('<QQ')
+
+    def __init__(self, slots, slot_bytes, name=None):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.stride = self.HEADER.size + slot_bytes
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=slots * self.stride)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+
+    def write(self, slot, sequence, data):
+        data = memoryview(data).cast('B')
+        if data.nbytes > self.slot_bytes:
+            return False
+        offset = slot * self.stride
+        self.memory.buf[offset + self.HEADER.size:offset + self.HEADER.size + data.nbytes] = data
+        self.HEADER.pack_into(self.memory.buf, offset, sequence, data.nbytes)
+        return True
+
+    def view(self, slot):
+        offset = slot * self.stride
+        sequence, length = self.HEADER.unpack_from(self.memory.buf, offset)
+        return sequence, self.memory.buf[offset + self.HEADER.size:offset + self.HEADER.size + length]
+
+    def close(self, unlink=False):
+        self.memory.close()
+        if unlink:
+            self.memory.unlink()
+
+
+def run_encode_worker(input_name, output_name, slots, slot_bytes, output_slot_bytes, tasks, results):
+    # 编码工作进程: 从输入环映射原始帧，编码后写入输出环的同一槽位；
+    # 任务类型为 jpeg(缩放并压缩整帧) 或 tiles(按图块分类编码，结果依次拼接，各图块的格式和长度通过结果队列返回)
+    input_ring = SharedFrameRing(slots, slot_bytes, input_name)
+    output_ring = SharedFrameRing(slots, output_slot_bytes, output_name)
     try:
         while True:
-            start_time = time.time()
+            task = tasks.get()
+            if task is None:
+                break
+            slot, sequence, shape, job = task
+            written_sequence, raw = input_ring.view(slot)
+            if written_sequence != sequence:
+                del raw
+                results.put((slot, sequence, -1, None))
+                continue
+            try:
+                frame = np.ndarray(shape, dtype=np.uint8, buffer=raw)
+                if job[0] == 'tiles':
+                    _, positions, tile_size, quality = job
+                    encoded = [encode_tile_data(frame[y:y + tile_size, x:x + tile_size], quality)
+                               for x, y in positions]
+                    formats = [(tile_format, len(data)) for tile_format, data in encoded]
+                    buffer = b''.join(data for _, data in encoded)
+                else:
+                    _, channel_order, scale, quality = job
+                    if scale < 1.0:
+                        frame = cv2.resize(frame, (int(shape[1] * scale), int(shape[0] * scale)),
+                                           interpolation=cv2.INTER_AREA)
+                    if channel_order == 'RGB':
+                        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+                    result, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+                    formats = None
+                del frame, raw
+                length = memoryview(buffer).nbytes if output_ring.write(slot, sequence, buffer) else -1
+            except Exception:
+                # 单帧编码失败时回报失败，不让工作进程退出；释放对共享内存的引用，否则退出时无法关闭
+                frame = raw = None
+                length, formats = -1, None
+            results.put((slot, sequence, length, formats))
+    finally:
+        input_ring.close()
+        output_ring.close()
+
+
+class FrameBus:
+    # 多进程编码: 服务进程把原始帧写入共享内存输入环，工作进程缩放编码后把 JPEG 或图块写入输出环，
+    # 进程间只通过队列传递槽位号等少量参数；槽位用完时调用方阻塞，起到背压作用；
+    # 编码结果远小于原始帧，输出环使用单独的较小槽位；
+    # 工作进程意外退出时停用总线，之后的帧都由调用方在本进程内编码
+    def __init__(self, workers, slot_bytes=FRAME_BUS_SLOT_BYTES, output_slot_bytes=FRAME_BUS_OUTPUT_SLOT_BYTES):
+        context = multiprocessing.get_context('spawn')
+        self.slots = workers * 2
+        self.input_ring = SharedFrameRing(self.slots, slot_bytes)
+        self.output_ring = SharedFrameRing(self.slots, output_slot_bytes)
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.free_slots = Queue()
+        for slot in range(self.slots):
+            self.free_slots.put(slot)
+        self.waiting = {}
+        self.sequence = 0
+        self.running = True
+        self.lock = Lock()
+        self.workers = [context.Process(target=run_encode_worker, daemon=True,
+                                        args=(self.input_ring.name, self.output_ring.name, self.slots, slot_bytes,
+                                              output_slot_bytes, self.tasks, self.results))
+                        for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+        Thread(target=self._collect_results, daemon=True).start()
+        logger.info(f"已启动 {workers} 个编码工作进程")
+
+    def _collect_results(self):
+        while True:
+            result = self.results.get()
+            if result is None:
+                break
+            slot, sequence, length, formats = result
+            with self.lock:
+                waiter = self.waiting.get(slot)
+                if waiter is None or waiter['sequence'] != sequence:
+                    continue
+                if waiter['abandoned']:
+                    # 调用方已超时放弃，工作进程不再使用该槽位后才能回收
+                    del self.waiting[slot]
+                    self.free_slots.put(slot)
+                else:
+                    waiter['length'] = length
+                    waiter['formats'] = formats
+                    waiter['done'].set()
+
+    def check_workers(self):
+        if self.running and not all(worker.is_alive() for worker in self.workers):
+            with self.lock:
+                if not self.running:
+                    return False
+                self.running = False
+            logger.error("编码工作进程意外退出，改为在服务进程内编码")
+            for worker in self.workers:
+                worker.terminate()
+        return self.running
+
+    def encode(self, frame, channel_order, scale, quality, timeout=5):
+        # 返回 JPEG 字节；帧过大、工作进程无响应或已退出时返回 None，由调用方在本进程内编码
+        result = self._run(frame, ('jpeg', channel_order, scale, quality), timeout)
+        return result and result[0]
+
+    def encode_tiles(self, frame, positions, quality, timeout=5):
+        # 编码 RGB 帧中左上角位于 positions 的图块，返回与 positions 对应的 (格式, 数据) 列表；失败时返回 None
+        result = self._run(frame, ('tiles', list(positions), TILE_SIZE, quality), timeout)
+        if result is None:
+            return None
+        data, formats = result
+        encoded = []
+        offset = 0
+        for tile_format, length in formats:
+            encoded.append((tile_format, data[offset:offset + length]))
+            offset += length
+        return encoded
+
+    def _run(self, frame, job, timeout):
+        # 返回 (输出数据, 图块格式列表)，失败时返回 None
+        if not self.check_workers():
+            return None
+        frame = np.ascontiguousarray(frame)
+        try:
+            slot = self.free_slots.get(timeout=timeout)
+        except Empty:
+            logger.warning("编码槽位全部被占用")
+            return None
+        with self.lock:
+            self.sequence += 1
+            sequence = self.sequence
+        if not self.input_ring.write(slot, sequence, frame):
+            self.free_slots.put(slot)
+            return None
+        waiter = {'sequence': sequence, 'done': Event(), 'length': -1, 'formats': None, 'abandoned': False}
+        with self.lock:
+            self.waiting[slot] = waiter
+        self.tasks.put((slot, sequence, frame.shape, job))
+        deadline = time.time() + timeout
+        while not waiter['done'].wait(min(0.1, max(0.0, deadline - time.time()))):
+            if time.time() >= deadline or not self.check_workers():
+                break
+        with self.lock:
+            if not waiter['done'].is_set():
+                # 工作进程可能仍在读写该槽位，槽位留给收集线程在结果到达后回收，避免下一帧读写到不完整的数据
+                waiter['abandoned'] = True
+                logger.warning("编码工作进程未能完成编码")
+                return None
+            del self.waiting[slot]
+        try:
+            if waiter['length'] < 0:
+                return None
+            written_sequence, data = self.output_ring.view(slot)
+            encoded = bytes(data) if written_sequence == sequence else None
+            del data
+            return None if encoded is None else (encoded, waiter['formats'])
+        finally:
+            self.free_slots.put(slot)
 
-            # 获取屏幕截图
-            image = ImageGrab.grab()
+    def close(self):
+        if not self.workers:
+            return
+        self.running = False
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout=2)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        # 被强制结束的工作进程可能还持有队列的写锁，不能让退出时等待队列的发送线程
+        self.tasks.cancel_join_thread()
+        self.results.cancel_join_thread()
+        self.results.put(None)
+        self.input_ring.close(unlink=True)
+        self.output_ring.close(unlink=True)
+
+
+def start_frame_bus(workers):
+    global frame_bus
+    frame_bus = FrameBus(workers)
+    atexit.register(frame_bus.close)
+
+
+def get_screen_scale(viewport=None):
+    # 查看整个主屏幕时按缩放因子编码，查看局部区域(放大)时按原始分辨率编码
+    viewport = viewport or get_screen_viewport()
+    return SCREEN_RESOLUTION_SCALE if tuple(viewport) == get_primary_viewport() else 1.0
+
+
+def capture_screen_image(resize=True, viewport=None):
+    # 返回截图和画面中检测到变化的延迟探测记录；resize 为 False 时不缩放，交给编码工作进程处理
+    viewport = viewport or get_screen_viewport()
+    if tuple(viewport) != get_primary_viewport():
+        # 局部区域只截取该区域，并按原始分辨率编码
+        x, y, width, height = viewport
+        image = ImageGrab.grab(bbox=(x, y, x + width, y + height), all_screens=True)
+        return image, latency_probe.check_frame(image, (x, y), time.time())
+
+    # 获取屏幕截图
+    image = ImageGrab.grab()
+    probes = latency_probe.check_frame(image, (0, 0), time.time())
+
+    # 调整分辨率
+    if resize and SCREEN_RESOLUTION_SCALE < 1.0:
+        new_size = (int(image.width * SCREEN_RESOLUTION_SCALE),
+                    int(image.height * SCREEN_RESOLUTION_SCALE))
+        image = image.resize(new_size, Image.Resampling.LANCZOS)
+    return image, probes
+
+
+def generate_screen_frames(viewport=None):
+    try:
+        while True:
+            start_time = time.time()
 
-            # 调整分辨率
-            if SCREEN_RESOLUTION_SCALE < 1.0:
-                new_size = (int(image.width * SCREEN_RESOLUTION_SCALE),
-                            int(image.height * SCREEN_RESOLUTION_SCALE))
-                image = image.resize(new_size, Image.Resampling.LANCZOS)
+            if frame_bus:
+                # 多进程编码模式下缩放和压缩都在编码工作进程中完成
+                image, probes = capture_screen_image(resize=False, viewport=viewport)
+                scale = get_screen_scale(viewport)
+                encoded = frame_bus.encode(np.asarray(image.convert('RGB')), 'RGB', scale, DEFAULT_SCREEN_QUALITY)
+                if encoded is None:
+                    image = image.resize((int(image.width * scale), int(image.height * scale)),
+                                         Image.Resampling.LANCZOS)
+            else:
+                image, probes = capture_screen_image(viewport=viewport)
+                encoded = None
 
             # 压缩图像
-            image_byte_array = io.BytesIO()
-            image.save(image_byte_array, format='JPEG', quality=DEFAULT_SCREEN_QUALITY, optimize=True)
+            if encoded is None:
+                image_byte_array = io.BytesIO()
+                image.save(image_byte_array, format='JPEG', quality=DEFAULT_SCREEN_QUALITY, optimize=True)
+                encoded = image_byte_array.getvalue()
+            latency_probe.mark_encoded(probes)
 
             yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + image_byte_array.getvalue() + b'\r\n')
+                   b'Content-Type: image/jpeg\r\n'
+                   b'Content-Length: %d\r\n\r\n' % len(encoded) + encoded + b'\r\n')
+            latency_probe.mark_delivered(probes)
 
             # 精确控制帧率
             elapsed = time.time() - start_time
@@ -123,9 +938,297 @@ def generate_screen_frames():
         logger.error(f"生成屏幕截图流出错: {error}")
 
 
+def generate_snapshot_frames(scale, quality, interval):
+    # 低分辨率、低帧率的整屏快照流，供网关生成缩略图墙
+    try:
+        while True:
+            start_time = time.time()
+
+            image = ImageGrab.grab()
+            image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+                                 Image.Resampling.BILINEAR, reducing_gap=2.0)
+            image_byte_array = io.BytesIO()
+            image.convert('RGB').save(image_byte_array, format='JPEG', quality=quality)
+            encoded = image_byte_array.getvalue()
+
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n'
+                   b'Content-Length: %d\r\n\r\n' % len(encoded) + encoded + b'\r\n')
+
+            elapsed = time.time() - start_time
+            time.sleep(max(0, interval - elapsed))
+
+    except Exception as error:
+        logger.error(f"生成屏幕快照流出错: {error}")
+
+
+def encode_tile_data(tile, quality):
+    # 颜色少的图块(文字、界面)用调色板PNG无损编码，颜色丰富的图块(照片、视频)用JPEG
+    packed = (tile[..., 0].astype(np.uint32) << 16) | (tile[..., 1].astype(np.uint32) << 8) | tile[..., 2]
+    colors, indices = np.unique(packed, return_inverse=True)
+    buffer = io.BytesIO()
+    if colors.size <= TILE_PALETTE_MAX_COLORS:
+        palette = np.stack([(colors >> 16) & 0xFF, (colors >> 8) & 0xFF, colors & 0xFF], axis=1)
+        image = Image.fromarray(indices.reshape(tile.shape[:2]).astype(np.uint8), mode='P')
+        image.putpalette(palette.astype(np.uint8).tobytes())
+        image.save(buffer, format='PNG')
+        return 'png', buffer.getvalue()
+    Image.fromarray(tile).save(buffer, format='JPEG', quality=quality)
+    return 'jpeg', buffer.getvalue()
+
+
+class TileEncoder:
+    # 图块编码缓存按内容摘要和质量索引，内容不变的图块只编码一次，并在所有客户端之间共享；
+    # 多进程编码模式下，一帧中缓存未命中的图块一次性交给编码工作进程处理
+    def __init__(self, max_entries=TILE_CACHE_MAX_ENTRIES):
+        self.cache = OrderedDict()
+        self.max_entries = max_entries
+        self.lock = Lock()
+
+    @staticmethod
+    def tile_digest(tile):
+        return hashlib.blake2b(tile.tobytes(), digest_size=16).digest()
+
+    def _cached(self, key):
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached:
+                self.cache.move_to_end(key)
+            return cached
+
+    def _store(self, key, encoded):
+        with self.lock:
+            self.cache[key] = encoded
+            if len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+    def encode_tile(self, tile, digest, quality):
+        key = (digest, tile.shape, quality)
+        encoded = self._cached(key)
+        if not encoded:
+            encoded = encode_tile_data(tile, quality)
+            self._store(key, encoded)
+        return encoded
+
+    def encode_frame(self, frame, sent_tiles, quality):
+        # sent_tiles 记录某个客户端每个位置上已发送图块的摘要，只发送发生变化的图块
+        height, width = frame.shape[:2]
+        if sent_tiles.get('size') != (width, height):
+            sent_tiles.clear()
+            sent_tiles['size'] = (width, height)
+        tiles = []
+        encoded = {}
+        missing = {}
+        for y in range(0, height, TILE_SIZE):
+            for x in range(0, width, TILE_SIZE):
+                tile = frame[y:y + TILE_SIZE, x:x + TILE_SIZE]
+                # 先比较摘要，客户端已有的图块不需要编码(即使它已被移出共享缓存)
+                digest = self.tile_digest(tile)
+                if sent_tiles.get((x, y)) == digest:
+                    continue
+                sent_tiles[(x, y)] = digest
+                key = (digest, tile.shape, quality)
+                tiles.append((x, y, key))
+                if key not in encoded:
+                    encoded[key] = self._cached(key)
+                    if not encoded[key]:
+                        missing[key] = (x, y)
+        if not tiles:
+            return None
+        if missing:
+            positions = list(missing.values())
+            results = frame_bus.encode_tiles(frame, positions, quality) if frame_bus else None
+            if results is None:
+                results = [encode_tile_data(frame[y:y + TILE_SIZE, x:x + TILE_SIZE], quality) for x, y in positions]
+            for key, result in zip(missing, results):
+                encoded[key] = result
+                self._store(key, result)
+        payloads = [encoded[key][1] for _, _, key in tiles]
+        payload = b''.join(payloads)
+        header = json.dumps({'width': width, 'height': height,
+                             'tiles': [[x, y, encoded[key][0], len(encoded[key][1])] for x, y, key in tiles],
+                             'size': len(payload)}).encode('utf-8')
+        return struct.pack('>I', len(header)) + header + payload
+
+    @staticmethod
+    def keepalive_message():
+        header = json.dumps({'tiles': [], 'size': 0}).encode('utf-8')
+        return struct.pack('>I', len(header)) + header
+
+
+tile_encoder = TileEncoder()
+
+
+def generate_screen_tiles(viewport=None):
+    sent_tiles = {}
+    last_sent = time.time()
+    try:
+        while True:
+            start_time = time.time()
+
+            # 图块流按原始分辨率分类和编码，缩放会给文字边缘引入过渡色，使文字图块落入JPEG且变模糊；
+            # 画面不变的图块不重复发送，原始分辨率带来的额外流量有限
+            image, probes = capture_screen_image(resize=False, viewport=viewport)
+            frame = np.asarray(image.convert('RGB'))
+            message = tile_encoder.encode_frame(frame, sent_tiles, DEFAULT_SCREEN_QUALITY)
+            latency_probe.mark_encoded(probes)
+            # 画面静止时也定期写出空消息，否则客户端断开后服务端无法察觉，采集循环会一直运行
+            if not message and start_time - last_sent >= TILE_KEEPALIVE_SECONDS:
+                message = tile_encoder.keepalive_message()
+            if message:
+                last_sent = start_time
+                yield message
+            latency_probe.mark_delivered(probes)
+
+            # 精确控制帧率
+            elapsed = time.time() - start_time
+            sleep_time = max(0, (1.0 / SCREEN_FRAME_RATE) - elapsed)
+            time.sleep(sleep_time)
+
+    except Exception as error:
+        logger.error(f"生成屏幕图块流出错: {error}")
+
+
+# Windows 标准光标句柄对应的 CSS 光标名称
+WINDOWS_CURSOR_SHAPES = {
+    32512: 'default',
+    32513: 'text',
+    32514: 'wait',
+    32515: 'crosshair',
+    32642: 'nwse-resize',
+    32643: 'nesw-resize',
+    32644: 'ew-resize',
+    32645: 'ns-resize',
+    32646: 'move',
+    32648: 'not-allowed',
+    32649: 'pointer',
+    32650: 'progress',
+}
+
+
+class CURSORINFO(ctypes.Structure):
+    _fields_ = [('cbSize', ctypes.c_uint32),
+                ('flags', ctypes.c_uint32),
+                ('hCursor', ctypes.c_void_p),
+                ('x', ctypes.c_long),
+                ('y', ctypes.c_long)]
+
+
+class CursorTracker:
+    # 以高频率采样光标位置和形状，只在变化时推送给订阅者；没有订阅者时采样线程自动退出
+    def __init__(self):
+        self.condition = Condition()
+        self.state = None
+        self.sequence = 0
+        self.subscribers = 0
+        self.thread = None
+        self.shape_handles = None
+
+    def get_cursor_shape(self):
+        if platform.system() != 'Windows':
+            return 'default'
+        user32 = ctypes.windll.user32
+        if self.shape_handles is None:
+            user32.LoadCursorW.restype = ctypes.c_void_p
+            self.shape_handles = {user32.LoadCursorW(None, ctypes.c_void_p(cursor_id)): shape
+                                  for cursor_id, shape in WINDOWS_CURSOR_SHAPES.items()}
+        info = CURSORINFO(cbSize=ctypes.sizeof(CURSORINFO))
+        if not user32.GetCursorInfo(ctypes.byref(info)):
+            return 'default'
+        if not info.flags & 1:
+            return 'none'
+        return self.shape_handles.get(info.hCursor, 'default')
+
+    def subscribe(self):
+        with self.condition:
+            self.subscribers += 1
+            self._start_sampling()
+
+    def _start_sampling(self):
+        # 调用方需持有 self.condition
+        if self.thread is None:
+            self.thread = Thread(target=self._sample_cursor, daemon=True)
+            self.thread.start()
+
+    def unsubscribe(self):
+        with self.condition:
+            self.subscribers -= 1
+
+    def _sample_cursor(self):
+        try:
+            while True:
+                start_time = time.time()
+                with self.condition:
+                    if self.subscribers <= 0:
+                        self.thread = None
+                        return
+                x, y = pyautogui.position()
+                state = {'x': int(x), 'y': int(y), 'shape': self.get_cursor_shape()}
+                with self.condition:
+                    if state != self.state:
+                        self.state = state
+                        self.sequence += 1
+                        self.condition.notify_all()
+                elapsed = time.time() - start_time
+                time.sleep(max(0, (1.0 / CURSOR_SAMPLE_RATE) - elapsed))
+        except Exception as error:
+            logger.error(f"光标采样出错: {error}")
+            with self.condition:
+                if self.thread is current_thread():
+                    self.thread = None
+
+    def generate_cursor_events(self):
+        self.subscribe()
+        try:
+            sequence = 0
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.sequence != sequence, timeout=CURSOR_KEEPALIVE_SECONDS)
+                    state = self.state
+                    changed = self.sequence != sequence
+                    sequence = self.sequence
+                    # 采样线程出错退出后，只要还有订阅者就重新启动采样
+                    if not changed:
+                        self._start_sampling()
+                # 长时间无变化时发送注释行保持连接
+                yield f"data: {json.dumps(state)}\n\n" if changed else ": keep-alive\n\n"
+        finally:
+            self.unsubscribe()
+
+
+cursor_tracker = CursorTracker()
+
+
 @app.route('/video_stream')
 def video_stream():
-    return Response(generate_screen_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    try:
+        viewport = request_viewport()
+    except ValueError as error:
+        return jsonify({"错误": str(error)}), 400
+    return Response(generate_screen_frames(viewport), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+@app.route('/snapshot_stream')
+def snapshot_stream():
+    try:
+        scale = float(request.args.get('scale', GATEWAY_THUMBNAIL_SCALE))
+        quality = int(request.args.get('quality', GATEWAY_THUMBNAIL_QUALITY))
+        interval = float(request.args.get('interval', GATEWAY_THUMBNAIL_INTERVAL))
+    except ValueError:
+        return jsonify({"错误": "scale、quality、interval 必须为数字"}), 400
+    if not (0.05 <= scale <= 1.0 and 0 <= quality <= 100 and interval > 0):
+        return jsonify({"错误": "scale 必须在0.05-1.0之间，quality 必须在0-100之间，interval 必须为正数"}), 400
+    return Response(generate_snapshot_frames(scale, quality, interval),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+
+@app.route('/screen_tile_stream')
+def screen_tile_stream():
+    try:
+        viewport = request_viewport()
+    except ValueError as error:
+        return jsonify({"错误": str(error)}), 400
+    return Response(generate_screen_tiles(viewport), mimetype='application/octet-stream')
 
 
 @app.route('/camera_stream')
@@ -133,16 +1236,39 @@ def camera_stream():
     return Response(camera_processor.generate_camera_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
+@app.route('/cursor_stream')
+def cursor_stream():
+    return Response(cursor_tracker.generate_cursor_events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+
+@app.route('/camera_motion')
+def camera_motion():
+    since = request.args.get('since')
+    try:
+        since = float(since) if since else None
+    except ValueError:
+        return jsonify({"错误": "since 必须为时间戳(秒)"}), 400
+    return jsonify(camera_processor.motion_detector.to_dict(since))
+
+
 @app.route('/mouse_click', methods=['POST'])
 def mouse_click():
+    received_at = time.time()
     data = request.get_json()
     required_params = ['x', 'y', 'scale_x', 'scale_y', 'click_type']
     if any(param not in data for param in required_params):
         logger.error(f"鼠标点击请求缺少必要参数: {', '.join(param for param in required_params if param not in data)}")
         return jsonify(
             {"错误": f"缺少必要参数: {', '.join(param for param in required_params if param not in data)}"}), 400
-    actual_x = int(data['x'] * data['scale_x'])
-    actual_y = int(data['y'] * data['scale_y'])
+    # 客户端坐标相对于它所查看的区域，需要加上区域在桌面上的偏移；未指定区域时使用默认区域
+    try:
+        viewport = parse_viewport(data['viewport']) if data.get('viewport') else get_screen_viewport()
+    except (ValueError, TypeError) as error:
+        return jsonify({"错误": f"无效的查看区域: {error}"}), 400
+    origin_x, origin_y = viewport[:2]
+    actual_x = int(data['x'] * data['scale_x']) + origin_x
+    actual_y = int(data['y'] * data['scale_y']) + origin_y
     click_type = data['click_type']
     click_functions = {
         '左键': pyautogui.click,
@@ -151,9 +1277,12 @@ def mouse_click():
         '拖动': pyautogui.dragTo
     }
     click_function = click_functions.get(click_type)
+    probe = latency_probe.begin(data.get('probe'), received_at,
+                                (actual_x - LATENCY_PROBE_REGION_SIZE // 2, actual_y - LATENCY_PROBE_REGION_SIZE // 2,
+                                 LATENCY_PROBE_REGION_SIZE, LATENCY_PROBE_REGION_SIZE), viewport)
     if click_type == '拖动':
-        start_x = int(data.get('start_x', 0) * data['scale_x'])
-        start_y = int(data.get('start_y', 0) * data['scale_y'])
+        start_x = int(data.get('start_x', 0) * data['scale_x']) + origin_x
+        start_y = int(data.get('start_y', 0) * data['scale_y']) + origin_y
         pyautogui.moveTo(start_x, start_y)
         pyautogui.mouseDown()
         click_function(actual_x, actual_y)
@@ -163,21 +1292,75 @@ def mouse_click():
     else:
         logger.error(f"无效的点击类型: {click_type}")
         return jsonify({"错误": f"无效的点击类型: {click_type}"}), 400
+    latency_probe.injected(probe)
     logger.info(f"鼠标 {click_type} 点击事件: 坐标 ({actual_x}, {actual_y})")
     return 'OK'
 
 
+@app.route('/get_viewport')
+def get_viewport():
+    x, y, width, height = get_screen_viewport()
+    return jsonify({
+        'monitors': list_monitors(),
+        'viewport': {'x': x, 'y': y, 'width': width, 'height': height},
+        'primary': dict(zip(VIEWPORT_PARAMS, get_primary_viewport())),
+        'is_custom': SCREEN_VIEWPORT is not None
+    })
+
+
+@app.route('/set_viewport', methods=['POST'])
+def set_viewport():
+    # 设置默认查看区域，只影响未在查询参数中指定查看区域的屏幕流
+    global SCREEN_VIEWPORT
+    data = request.get_json()
+    if data.get('reset'):
+        SCREEN_VIEWPORT = None
+        return jsonify({"消息": "查看区域已恢复为主屏幕"})
+    try:
+        viewport = parse_viewport(data)
+    except ValueError as error:
+        return jsonify({"错误": str(error)}), 400
+    SCREEN_VIEWPORT = viewport
+    logger.info(f"默认查看区域已设置为: {viewport}")
+    return jsonify({"消息": "查看区域设置成功", "viewport": dict(zip(VIEWPORT_PARAMS, viewport))})
+
+
 @app.route('/keyboard_press', methods=['POST'])
 def keyboard_press():
+    received_at = time.time()
     data = request.get_json()
     if 'key' not in data:
         logger.error("键盘输入请求缺少必要参数: 按键")
         return jsonify({"错误": "缺少必要参数: 按键"}), 400
+    # 按键探测未指定区域时检测整个查看区域的变化
+    try:
+        viewport = parse_viewport(data['viewport']) if data.get('viewport') else get_screen_viewport()
+    except (ValueError, TypeError):
+        viewport = get_screen_viewport()
+    probe = latency_probe.begin(data.get('probe'), received_at, viewport, viewport)
     pyautogui.press(data['key'])
+    latency_probe.injected(probe)
     logger.info(f"键盘输入事件: 按键 {data['key']}")
     return 'OK'
 
 
+@app.route('/server_time')
+def server_time():
+    # 供延迟测试页面估计浏览器与服务器的时钟偏差
+    return jsonify({'time': time.time() * 1000})
+
+
+@app.route('/latency_stats')
+def latency_stats():
+    return jsonify(latency_probe.to_dict())
+
+
+@app.route('/reset_latency_stats', methods=['POST'])
+def reset_latency_stats():
+    latency_probe.reset()
+    return jsonify({"消息": "延迟统计已清空"})
+
+
 @app.route('/execute_command', methods=['POST'])
 def execute_command():
     data = request.get_json()
@@ -190,6 +1373,198 @@ def execute_command():
     return jsonify({'输出': output})
 
 
+def kill_process_tree(process):
+    # shell=True 时命令运行在子进程中，需要结束整个进程组
+    if platform.system() == 'Windows':
+        subprocess.run(f"taskkill /F /T /PID {process.pid}", shell=True, capture_output=True)
+    else:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class BatchJobStore:
+    # 批量命令任务: 每条命令单独提交到一个大小为 BATCH_MAX_WORKERS 的共享线程池；
+    # 线程池中排队的命令数不超过空闲线程数，空出位置时轮流从各任务中取下一条命令，
+    # 同一任务正在运行的命令数不超过它的 parallelism，因此大任务不会独占线程池
+    def __init__(self):
+        self.jobs = OrderedDict()
+        self.lock = Lock()
+        self.executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix='batch')
+        self.ready = deque()  # 还有待运行命令的任务，按轮转顺序排列
+        self.active = 0  # 已提交到线程池但尚未完成的命令数
+
+    def submit(self, commands, parallelism):
+        # 未完成的任务不会被清理，数量达到 BATCH_MAX_JOBS 时拒绝新任务，返回 None
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            'job_id': job_id,
+            'status': 'running',
+            'created_at': time.time(),
+            'finished_at': None,
+            'parallelism': parallelism,
+            'results': [{'index': index, 'command': command, 'timeout': timeout, 'status': 'queued',
+                         'exit_code': None, 'stdout': '', 'stderr': '', 'duration': None}
+                        for index, (command, timeout) in enumerate(commands)],
+            'pending': deque(range(len(commands))),
+            'running': 0,
+            'remaining': len(commands)
+        }
+        with self.lock:
+            if sum(job['status'] != 'finished' for job in self.jobs.values()) >= BATCH_MAX_JOBS:
+                return None
+            self.jobs[job_id] = job
+            self._evict()
+            self.ready.append(job)
+            self._dispatch()
+        return job_id
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job['status'] == 'finished']
+        while len(self.jobs) > BATCH_MAX_JOBS and finished:
+            del self.jobs[finished.pop(0)]
+
+    def _dispatch(self):
+        # 需持有 self.lock 调用；每轮从队首任务取一条命令后把任务移到队尾，达到并行数的任务本轮跳过
+        while self.active < BATCH_MAX_WORKERS and self.ready:
+            for _ in range(len(self.ready)):
+                job = self.ready.popleft()
+                if job['running'] < job['parallelism']:
+                    break
+                self.ready.append(job)
+            else:
+                return
+            result = job['results'][job['pending'].popleft()]
+            if job['pending']:
+                self.ready.append(job)
+            result['status'] = 'running'
+            job['running'] += 1
+            self.active += 1
+            self.executor.submit(self._run_one, job, result)
+
+    def _run_one(self, job, result):
+        try:
+            self._run_command(result)
+        finally:
+            with self.lock:
+                job['running'] -= 1
+                job['remaining'] -= 1
+                self.active -= 1
+                if job['remaining'] == 0:
+                    job['status'] = 'finished'
+                    job['finished_at'] = time.time()
+                    self._evict()
+                self._dispatch()
+
+    @staticmethod
+    def _read_limited(stream, output):
+        # 边读边丢弃超出 BATCH_OUTPUT_LIMIT 的部分，输出很多的命令也不会占用大量内存
+        size = 0
+        for chunk in iter(lambda: stream.read(8192), ''):
+            if size < BATCH_OUTPUT_LIMIT:
+                output['chunks'].append(chunk[:BATCH_OUTPUT_LIMIT - size])
+            size += len(chunk)
+        output['truncated'] = size > BATCH_OUTPUT_LIMIT
+        stream.close()
+
+    def _run_command(self, result):
+        start_time = time.time()
+        outputs = [{'chunks': [], 'truncated': False} for _ in range(2)]
+        try:
+            process = subprocess.Popen(result['command'], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       text=True, errors='replace', start_new_session=platform.system() != 'Windows')
+            readers = [Thread(target=self._read_limited, args=(stream, output), daemon=True)
+                       for stream, output in zip((process.stdout, process.stderr), outputs)]
+            for reader in readers:
+                reader.start()
+            try:
+                process.wait(timeout=result['timeout'])
+                status = 'finished'
+            except subprocess.TimeoutExpired:
+                kill_process_tree(process)
+                process.wait()
+                status = 'timeout'
+            for reader in readers:
+                reader.join()
+            exit_code = process.returncode
+            stdout, stderr = (''.join(output['chunks']) for output in outputs)
+        except Exception as error:
+            stdout, stderr, exit_code, status = '', str(error), None, 'error'
+        with self.lock:
+            result.update({
+                'status': status,
+                'exit_code': exit_code,
+                'stdout': stdout,
+                'stderr': stderr,
+                'truncated': any(output['truncated'] for output in outputs),
+                'duration': round(time.time() - start_time, 3)
+            })
+        logger.info(f"批量命令执行完成: {result['command']}, 状态: {status}, 退出码: {exit_code}")
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            summary = {key: value for key, value in job.items() if key not in ('pending', 'running', 'remaining')}
+            summary['results'] = [dict(result) for result in job['results']]
+            summary['completed'] = len(job['results']) - job['remaining']
+            return summary
+
+    def list_jobs(self):
+        with self.lock:
+            return [{'job_id': job_id, 'status': job['status'], 'created_at': job['created_at'],
+                     'commands': len(job['results']), 'completed': len(job['results']) - job['remaining']}
+                    for job_id, job in self.jobs.items()]
+
+
+batch_jobs = BatchJobStore()
+
+
+@app.route('/execute_batch', methods=['POST'])
+def execute_batch():
+    data = request.get_json()
+    if not data or not isinstance(data.get('commands'), list) or not data['commands']:
+        logger.error("批量执行请求缺少必要参数: commands")
+        return jsonify({"错误": "缺少必要参数: commands"}), 400
+    commands = []
+    try:
+        default_timeout = float(data.get('timeout', BATCH_DEFAULT_TIMEOUT))
+        parallelism = int(data.get('parallelism', BATCH_MAX_WORKERS))
+        for item in data['commands']:
+            # 每条命令可以是字符串，也可以是 {"command": ..., "timeout": ...}
+            if isinstance(item, dict):
+                commands.append((str(item['command']), float(item.get('timeout', default_timeout))))
+            else:
+                commands.append((str(item), default_timeout))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"错误": "无效的命令列表、超时时间或并行数"}), 400
+    if parallelism <= 0:
+        return jsonify({"错误": "并行数必须为正整数"}), 400
+    if not all(0 < timeout < float('inf') for timeout in [default_timeout] + [timeout for _, timeout in commands]):
+        return jsonify({"错误": "超时时间必须为正数"}), 400
+    job_id = batch_jobs.submit(commands, parallelism)
+    if job_id is None:
+        logger.warning("批量执行任务过多，拒绝新任务")
+        return jsonify({"错误": f"未完成的批量任务已达上限 {BATCH_MAX_JOBS}，请稍后再试"}), 503
+    logger.info(f"批量执行任务 {job_id} 已提交: {len(commands)} 条命令, 并行数 {parallelism}")
+    return jsonify({'job_id': job_id, '命令数': len(commands)})
+
+
+@app.route('/batch_status/<job_id>')
+def batch_status(job_id):
+    job = batch_jobs.get(job_id)
+    if job is None:
+        return jsonify({"错误": f"任务不存在或已被清理: {job_id}"}), 404
+    return jsonify(job)
+
+
+@app.route('/batch_jobs')
+def batch_job_list():
+    return jsonify(batch_jobs.list_jobs())
+
+
 @app.route('/get_computer_info')
 def get_computer_info():
     return jsonify({
@@ -263,9 +1638,174 @@ def upload_file():
         return jsonify({"消息": "文件上传成功"})
 
 
+def weak_checksum(block):
+    # rsync 滚动校验和: a 为字节和，b 为按位置加权的字节和，各取 16 位
+    values = np.frombuffer(block, dtype=np.uint8).astype(np.int64)
+    a = int(values.sum()) % 65536
+    b = int((values * np.arange(len(values), 0, -1)).sum()) % 65536
+    return a | (b << 16)
+
+
+def strong_checksum(block):
+    return hashlib.blake2b(block, digest_size=16).hexdigest()
+
+
+def resolve_upload_path(name):
+    # 允许子目录，但不允许跳出上传目录
+    base = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    path = os.path.abspath(os.path.join(base, name or ''))
+    if not name or os.path.commonpath([base, path]) != base or path == base:
+        return None
+    return path
+
+
+class SignatureCache:
+    # 按 (路径, 修改时间, 大小, 分块大小) 缓存文件的分块校验和，文件未修改时无需重新读取
+    def __init__(self, max_entries=SIGNATURE_CACHE_MAX_ENTRIES):
+        self.cache = OrderedDict()
+        self.max_entries = max_entries
+        self.lock = Lock()
+
+    def get(self, path, block_size):
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size, block_size)
+        with self.lock:
+            blocks = self.cache.get(key)
+            if blocks is not None:
+                self.cache.move_to_end(key)
+                return stat, blocks
+        blocks = []
+        with open(path, 'rb') as file:
+            while True:
+                block = file.read(block_size)
+                if not block:
+                    break
+                blocks.append([weak_checksum(block), strong_checksum(block)])
+        with self.lock:
+            self.cache[key] = blocks
+            if len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+        return stat, blocks
+
+    def invalidate(self, path):
+        with self.lock:
+            for key in [key for key in self.cache if key[0] == path]:
+                del self.cache[key]
+
+
+signature_cache = SignatureCache()
+
+
+def parse_block_size(value):
+    block_size = int(value or DELTA_BLOCK_SIZE)
+    if not 1024 <= block_size <= 16 * 1024 * 1024:
+        raise ValueError(block_size)
+    return block_size
+
+
+def parse_recipe(recipe):
+    # 校验 recipe 的结构: ["copy", 起始块号>=0, 块数>0] 或 ["data", 长度>=0]
+    def is_count(value, minimum):
+        return isinstance(value, int) and not isinstance(value, bool) and value >= minimum
+
+    if not isinstance(recipe, list):
+        raise ValueError("recipe 必须是操作列表")
+    for op in recipe:
+        valid = isinstance(op, list) and op and (
+            (op[0] == 'copy' and len(op) == 3 and is_count(op[1], 0) and is_count(op[2], 1))
+            or (op[0] == 'data' and len(op) == 2 and is_count(op[1], 0)))
+        if not valid:
+            raise ValueError(f"无效的操作: {json.dumps(op, ensure_ascii=False)[:100]}")
+    return recipe
+
+
+@app.route('/upload_signature')
+def upload_signature():
+    path = resolve_upload_path(request.args.get('path'))
+    if path is None:
+        return jsonify({"错误": "无效的文件路径"}), 400
+    try:
+        block_size = parse_block_size(request.args.get('block_size'))
+    except ValueError:
+        return jsonify({"错误": "分块大小必须在1KB-16MB之间"}), 400
+    if not os.path.isfile(path):
+        return jsonify({'exists': False, 'block_size': block_size, 'blocks': []})
+    stat, blocks = signature_cache.get(path, block_size)
+    return jsonify({'exists': True, 'size': stat.st_size, 'mtime': stat.st_mtime, 'block_size': block_size,
+                    'blocks': blocks})
+
+
+@app.route('/upload_delta', methods=['POST'])
+def upload_delta():
+    # recipe 为操作列表: ["copy", 起始块号, 块数] 从旧文件复制，["data", 长度] 从上传的 data 中顺序读取；
+    # 新文件边写边校验，写入临时文件后原子替换，不在内存中保存完整文件
+    path = resolve_upload_path(request.form.get('path'))
+    if path is None:
+        return jsonify({"错误": "无效的文件路径"}), 400
+    try:
+        block_size = parse_block_size(request.form.get('block_size'))
+        recipe = parse_recipe(json.loads(request.form['recipe']))
+        expected_hash = request.form['sha256']
+    except ValueError as error:
+        return jsonify({"错误": f"无效的参数: {error}"}), 400
+    except KeyError:
+        return jsonify({"错误": "缺少或无效的参数: block_size, recipe, sha256"}), 400
+    if os.path.isdir(path):
+        return jsonify({"错误": "目标路径是一个目录"}), 400
+    literal_stream = request.files['data'].stream if 'data' in request.files else io.BytesIO()
+    if any(op[0] == 'copy' for op in recipe) and not os.path.isfile(path):
+        return jsonify({"错误": "服务器上不存在要复制的旧文件"}), 409
+
+    digest = hashlib.sha256()
+    copied = transferred = 0
+    temporary = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False)
+        with temporary, open(path, 'rb') if os.path.isfile(path) else io.BytesIO() as old_file:
+            for op in recipe:
+                if op[0] == 'copy':
+                    old_file.seek(op[1] * block_size)
+                    remaining = op[2] * block_size
+                    source = old_file
+                else:
+                    remaining = op[1]
+                    source = literal_stream
+                while remaining > 0:
+                    chunk = source.read(min(remaining, 1024 * 1024))
+                    if not chunk:
+                        if op[0] == 'data':
+                            raise ValueError("上传的数据长度不足")
+                        break
+                    remaining -= len(chunk)
+                    temporary.write(chunk)
+                    digest.update(chunk)
+                    if op[0] == 'copy':
+                        copied += len(chunk)
+                    else:
+                        transferred += len(chunk)
+        if digest.hexdigest() != expected_hash:
+            raise ValueError("重建后的文件校验失败")
+        os.replace(temporary.name, path)
+        temporary = None
+    except ValueError as error:
+        logger.error(f"文件 {request.form.get('path')} 增量同步失败: {error}")
+        return jsonify({"错误": str(error)}), 400
+    except OSError as error:
+        logger.error(f"文件 {request.form.get('path')} 增量同步失败: {error}")
+        return jsonify({"错误": f"写入文件失败: {error}"}), 500
+    finally:
+        # 任何失败都删除临时文件，避免在上传目录中留下残留
+        if temporary is not None:
+            os.remove(temporary.name)
+    signature_cache.invalidate(path)
+    logger.info(f"文件 {request.form.get('path')} 增量同步成功: 复用 {copied} 字节, 传输 {transferred} 字节")
+    return jsonify({"消息": "文件同步成功", "复用字节": copied, "传输字节": transferred})
+
+
 @app.route('/set_frame_rate', methods=['POST'])
 def set_frame_rate():
-    global SCREEN_FRAME_RATE, CAMERA_FRAME_RATE
+    global SCREEN_FRAME_RATE, CAMERA_FRAME_RATE, CAMERA_IDLE_FRAME_RATE, MOTION_DETECTION_ENABLED
     data = request.get_json()
     if 'screen_frame_rate' in data:
         try:
@@ -287,6 +1827,17 @@ def set_frame_rate():
                 return jsonify({"错误": "摄像头帧率必须为正整数"}), 400
         except ValueError:
             return jsonify({"错误": "摄像头帧率必须为正整数"}), 400
+    if 'camera_idle_frame_rate' in data:
+        try:
+            new_idle_frame_rate = float(data['camera_idle_frame_rate'])
+            if new_idle_frame_rate > 0:
+                CAMERA_IDLE_FRAME_RATE = new_idle_frame_rate
+            else:
+                return jsonify({"错误": "摄像头静止帧率必须为正数"}), 400
+        except ValueError:
+            return jsonify({"错误": "摄像头静止帧率必须为正数"}), 400
+    if 'motion_detection' in data:
+        MOTION_DETECTION_ENABLED = bool(data['motion_detection'])
     return jsonify({"消息": "帧率设置成功"})
 
 
@@ -338,7 +1889,7 @@ def set_client_hidden():
 
 @app.route('/set_stream_quality', methods=['POST'])
 def set_stream_quality():
-    global DEFAULT_SCREEN_QUALITY, DEFAULT_CAMERA_QUALITY, SCREEN_RESOLUTION_SCALE, CAMERA_RESOLUTION_SCALE
+    global DEFAULT_SCREEN_QUALITY, DEFAULT_CAMERA_QUALITY, SCREEN_RESOLUTION_SCALE, CAMERA_RESOLUTION_SCALE, HYBRID_SCREEN_ENCODING
     data = request.get_json()
 
     if 'screen_quality' in data:
@@ -369,10 +1920,13 @@ def set_stream_quality():
         else:
             return jsonify({"错误": "摄像头分辨率缩放因子必须在0.1-1.0之间"}), 400
 
+    if 'hybrid_encoding' in data:
+        HYBRID_SCREEN_ENCODING = bool(data['hybrid_encoding'])
+
     return jsonify({"消息": "流质量设置已更新"})
 
 
-def generate_html_template(title, content, return_button=True):
+def generate_html_template(title, content, return_button=True, settings_button=True):
     mobile_css = """
         @media (max-width: 768px) {
             .btn {
@@ -391,6 +1945,8 @@ def generate_html_template(title, content, return_button=True):
         }
     """ if IS_MOBILE_MODE else ""
     return_link = '<a href="/" class="btn btn-secondary back-button">返回菜单</a>' if return_button else ''
+    settings_toggle = '<button type="button" class="btn btn-primary settings-button" data-bs-toggle="modal" ' \
+                      'data-bs-target="#settingsModal">设置</button>' if settings_button else ''
     return f"""
     <!DOCTYPE html>
     <html lang="zh-CN">
@@ -428,7 +1984,7 @@ def generate_html_template(title, content, return_button=True):
         <div class="container my-5">
             {content}
         </div>
-        <button type="button" class="btn btn-primary settings-button" data-bs-toggle="modal" data-bs-target="#settingsModal">设置</button>
+        {settings_toggle}
         <div class="modal fade" id="settingsModal" tabindex="-1" aria-labelledby="settingsModalLabel" aria-hidden="true">
             <div class="modal-dialog">
                 <div class="modal-content">
@@ -461,6 +2017,10 @@ def generate_html_template(title, content, return_button=True):
                             <label for="cameraResolutionScale" class="form-label">摄像头分辨率缩放 (0.1-1.0)</label>
                             <input type="number" step="0.1" class="form-control" id="cameraResolutionScale" min="0.1" max="1.0" value="{CAMERA_RESOLUTION_SCALE}">
                         </div>
+                        <div class="mb-3 form-check">
+                            <input type="checkbox" class="form-check-input" id="hybridEncodingCheckbox" {'checked' if HYBRID_SCREEN_ENCODING else ''}>
+                            <label class="form-check-label" for="hybridEncodingCheckbox">文字区域无损编码</label>
+                        </div>
                         <div class="mb-3 form-check">
                             <input type="checkbox" class="form-check-input" id="mobileModeCheckbox" {'checked' if IS_MOBILE_MODE else ''}>
                             <label class="form-check-label" for="mobileModeCheckbox">手机模式</label>
@@ -486,6 +2046,7 @@ def generate_html_template(title, content, return_button=True):
                 const cameraQuality = document.getElementById('cameraQuality').value;
                 const screenResolutionScale = document.getElementById('screenResolutionScale').value;
                 const cameraResolutionScale = document.getElementById('cameraResolutionScale').value;
+                const hybridEncoding = document.getElementById('hybridEncodingCheckbox').checked;
                 const mobileMode = document.getElementById('mobileModeCheckbox').checked;
                 const clientHidden = document.getElementById('clientHiddenCheckbox').checked;
 
@@ -511,7 +2072,8 @@ def generate_html_template(title, content, return_button=True):
                         screen_quality: screenQuality,
                         camera_quality: cameraQuality,
                         screen_resolution_scale: screenResolutionScale,
-                        camera_resolution_scale: cameraResolutionScale
+                        camera_resolution_scale: cameraResolutionScale,
+                        hybrid_encoding: hybridEncoding
                     }})
                 }});
 
@@ -549,7 +2111,6 @@ def generate_html_template(title, content, return_button=True):
 
 @app.route('/')
 def home():
-    width, height = pyautogui.size()
     return render_template_string(generate_html_template("桌面投影菜单", f"""
         <div class="text-center">
             <h1 class="display-4">磊牌远程控制</h1>
@@ -559,6 +2120,7 @@ def home():
                 <a href="/computer_info" class="btn btn-primary">电脑参数</a>
                 <a href="/camera_view" class="btn btn-primary">摄像头查看</a>
                 <a href="/file_upload" class="btn btn-primary">文件上传</a>
+                <a href="/latency_test" class="btn btn-primary">延迟测试</a>
                 <button onclick="shutdownComputer()" class="btn btn-danger">远程关机</button>
                 <button onclick="restartComputer()" class="btn btn-warning">远程重启</button>
                 <div class="mt-3">
@@ -638,7 +2200,7 @@ def home():
 
 @app.route('/remote_control')
 def remote_control():
-    width, height = pyautogui.size()
+    x, y, width, height = get_screen_viewport()
     touch_events = """
         let isDragging = false;
         let startX = 0;
@@ -658,7 +2220,7 @@ def remote_control():
                     headers: {
                         'Content-Type': 'application/json'
                     },
-                    body: JSON.stringify({x: x, y: y, scale_x: scaleX, scale_y: scaleY, click_type: '左键'})
+                    body: JSON.stringify({x: x, y: y, scale_x: scaleX, scale_y: scaleY, click_type: '左键', viewport: currentViewport()})
                 });
             } else if (event.touches.length === 2) {
                 // 双指触摸开始拖动
@@ -680,7 +2242,7 @@ def remote_control():
                     headers: {
                         'Content-Type': 'application/json'
                     },
-                    body: JSON.stringify({x: x, y: y, scale_x: scaleX, scale_y: scaleY, click_type: '拖动', start_x: startX, start_y: startY})
+                    body: JSON.stringify({x: x, y: y, scale_x: scaleX, scale_y: scaleY, click_type: '拖动', start_x: startX, start_y: startY, viewport: currentViewport()})
                 });
             }
         });
@@ -689,17 +2251,123 @@ def remote_control():
             isDragging = false;
         });
     """ if IS_MOBILE_MODE else ""
+    # 混合编码模式下用画布拼接图块，否则直接显示MJPEG流；经网关访问时使用 mode=mjpeg 以便多个操作者共享同一条流。
+    # 每个页面在流的查询参数中指定自己的查看区域，缩放不影响其他观看者
+    use_tiles = HYBRID_SCREEN_ENCODING and request.args.get('mode') != 'mjpeg'
+    video_element = '<canvas id="video" class="img-fluid"></canvas>' if use_tiles else \
+        f'<img id="video" src="/video_stream?x={x}&y={y}&width={width}&height={height}" class="img-fluid">'
+    stream_script = """
+        const videoContext = video.getContext('2d');
+        const headerDecoder = new TextDecoder();
+        let drawChain = Promise.resolve();
+        let tileStream = null;
+
+        function drawTiles(header, payload, stream) {
+            // 并行解码图块，按帧顺序绘制，避免旧图块覆盖新图块
+            let offset = 0;
+            const bitmaps = header.tiles.map(function(tile) {
+                const data = payload.subarray(offset, offset + tile[3]);
+                offset += tile[3];
+                return createImageBitmap(new Blob([data], {type: 'image/' + tile[2]}));
+            });
+            drawChain = drawChain.then(function() {
+                return Promise.all(bitmaps);
+            }).then(function(images) {
+                // 切换查看区域后丢弃旧流中尚未绘制的图块
+                if (stream !== tileStream) {
+                    images.forEach(image => image.close());
+                    return;
+                }
+                if (video.width !== header.width || video.height !== header.height) {
+                    video.width = header.width;
+                    video.height = header.height;
+                }
+                images.forEach(function(image, index) {
+                    videoContext.drawImage(image, header.tiles[index][0], header.tiles[index][1]);
+                    image.close();
+                });
+            });
+        }
+
+        async function restartStream() {
+            if (tileStream) {
+                tileStream.abort();
+            }
+            const stream = new AbortController();
+            tileStream = stream;
+            const response = await fetch('/screen_tile_stream?' + viewportQuery(), {signal: stream.signal});
+            const reader = response.body.getReader();
+            let buffer = new Uint8Array(0);
+            while (true) {
+                const {value, done} = await reader.read().catch(() => ({done: true}));
+                if (done || stream !== tileStream) {
+                    break;
+                }
+                const merged = new Uint8Array(buffer.length + value.length);
+                merged.set(buffer);
+                merged.set(value, buffer.length);
+                buffer = merged;
+                // 每条消息: 4字节头部长度 + JSON头部 + 图块数据
+                while (buffer.length >= 4) {
+                    const headerLength = new DataView(buffer.buffer, buffer.byteOffset, 4).getUint32(0);
+                    if (buffer.length < 4 + headerLength) {
+                        break;
+                    }
+                    const header = JSON.parse(headerDecoder.decode(buffer.subarray(4, 4 + headerLength)));
+                    const total = 4 + headerLength + header.size;
+                    if (buffer.length < total) {
+                        break;
+                    }
+                    // 不含图块的消息只用于保活
+                    if (header.tiles.length) {
+                        drawTiles(header, buffer.subarray(4 + headerLength, total), stream);
+                    }
+                    buffer = buffer.slice(total);
+                }
+            }
+        }
+
+        restartStream();
+    """ if use_tiles else """
+        function restartStream() {
+            video.src = '/video_stream?' + viewportQuery();
+        }
+    """
     return render_template_string(generate_html_template("远程控制", f"""
         <div class="text-center">
             <h2>远程控制</h2>
+            <div class="d-flex justify-content-center gap-2 mt-3">
+                <select id="monitor-select" class="form-select w-auto"></select>
+                <button onclick="resetViewport()" class="btn btn-secondary">恢复整个屏幕</button>
+            </div>
+            <p class="text-muted small mt-2">按住 Ctrl 滚动鼠标滚轮可放大/缩小查看区域</p>
             <div id="video-container" class="mt-4">
-                <img id="video" src="/video_stream" class="img-fluid">
+                <div style="position: relative; display: inline-block;">
+                    {video_element}
+                    <svg id="cursor-overlay" width="20" height="24" style="position: absolute; left: 0; top: 0; pointer-events: none; display: none;">
+                        <path id="cursor-shape" stroke="white" stroke-width="1.5"></path>
+                    </svg>
+                </div>
             </div>
         </div>
         <script>
             const video = document.getElementById('video');
-            const screenWidth = {width};
-            const screenHeight = {height};
+            // 查看区域在桌面上的位置和大小，点击坐标按该区域换算
+            let screenLeft = {x};
+            let screenTop = {y};
+            let screenWidth = {width};
+            let screenHeight = {height};
+            let monitorBounds = {{x: {x}, y: {y}, width: {width}, height: {height}}};
+            let monitors = [];
+            let primaryViewport = monitorBounds;
+
+            function currentViewport() {{
+                return {{x: screenLeft, y: screenTop, width: screenWidth, height: screenHeight}};
+            }}
+
+            function viewportQuery() {{
+                return 'x=' + screenLeft + '&y=' + screenTop + '&width=' + screenWidth + '&height=' + screenHeight;
+            }}
             let clickTimer = null;
             let isDragging = false;
             let dragStartX = 0;
@@ -722,7 +2390,7 @@ def remote_control():
                         headers: {{
                             'Content-Type': 'application/json'
                         }},
-                        body: JSON.stringify({{x: x, y: y, scale_x: scaleX, scale_y: scaleY, click_type: '拖动', start_x: dragStartX, start_y: dragStartY}})
+                        body: JSON.stringify({{x: x, y: y, scale_x: scaleX, scale_y: scaleY, click_type: '拖动', start_x: dragStartX, start_y: dragStartY, viewport: currentViewport()}})
                     }});
                 }}
             }});
@@ -759,7 +2427,7 @@ def remote_control():
                     headers: {{
                         'Content-Type': 'application/json'
                     }},
-                    body: JSON.stringify({{x: x, y: y, scale_x: scaleX, scale_y: scaleY, click_type: clickType}})
+                    body: JSON.stringify({{x: x, y: y, scale_x: scaleX, scale_y: scaleY, click_type: clickType, viewport: currentViewport()}})
                 }});
             }}
 
@@ -774,7 +2442,116 @@ def remote_control():
                 }});
             }});
 
+            // 光标通过独立的事件流高频推送，并以覆盖层绘制，不受屏幕帧率影响
+            const cursorOverlay = document.getElementById('cursor-overlay');
+            const cursorShape = document.getElementById('cursor-shape');
+            const cursorPaths = {{
+                'default': ['M1 1 L1 17 L5 13 L8 20 L11 19 L8 12 L14 12 Z', 1, 1],
+                'text': ['M4 1 L10 1 M7 1 L7 19 M4 19 L10 19', 7, 10],
+                'pointer': ['M6 1 L9 1 L9 9 L15 10 L15 18 L12 22 L6 22 L2 14 L4 12 L6 14 Z', 7, 1]
+            }};
+            const cursorEvents = new EventSource('/cursor_stream');
+            cursorEvents.onmessage = function(event) {{
+                const cursor = JSON.parse(event.data);
+                if (cursor.shape === 'none') {{
+                    cursorOverlay.style.display = 'none';
+                    return;
+                }}
+                const path = cursorPaths[cursor.shape] || cursorPaths['default'];
+                cursorShape.setAttribute('d', path[0]);
+                cursorShape.setAttribute('fill', cursor.shape === 'text' ? 'none' : 'black');
+                cursorShape.setAttribute('stroke', cursor.shape === 'text' ? 'black' : 'white');
+                const cursorX = cursor.x - screenLeft;
+                const cursorY = cursor.y - screenTop;
+                if (cursorX < 0 || cursorY < 0 || cursorX >= screenWidth || cursorY >= screenHeight) {{
+                    cursorOverlay.style.display = 'none';
+                    return;
+                }}
+                cursorOverlay.style.left = (cursorX * video.offsetWidth / screenWidth - path[1]) + 'px';
+                cursorOverlay.style.top = (cursorY * video.offsetHeight / screenHeight - path[2]) + 'px';
+                cursorOverlay.style.display = 'block';
+                video.style.cursor = cursor.shape;
+            }};
+
+            const monitorSelect = document.getElementById('monitor-select');
+
+            function applyViewport(viewport) {{
+                screenLeft = viewport.x;
+                screenTop = viewport.y;
+                screenWidth = viewport.width;
+                screenHeight = viewport.height;
+                updateMonitorSelect();
+                restartStream();
+            }}
+
+            function updateMonitorSelect() {{
+                monitorSelect.value = '';
+                monitors.forEach(function(monitor, index) {{
+                    // 缩放和平移限制在当前区域所在的显示器内
+                    if (screenLeft >= monitor.x && screenLeft < monitor.x + monitor.width &&
+                        screenTop >= monitor.y && screenTop < monitor.y + monitor.height) {{
+                        monitorBounds = monitor;
+                        if (screenWidth === monitor.width && screenHeight === monitor.height &&
+                            !(monitor.x === primaryViewport.x && monitor.y === primaryViewport.y &&
+                              monitor.width === primaryViewport.width && monitor.height === primaryViewport.height)) {{
+                            monitorSelect.value = index;
+                        }}
+                    }}
+                }});
+            }}
+
+            function loadViewport() {{
+                fetch('/get_viewport')
+               .then(response => response.json())
+               .then(data => {{
+                    monitors = data.monitors;
+                    primaryViewport = data.primary;
+                    monitorSelect.innerHTML = '<option value="">主屏幕</option>';
+                    monitors.forEach(function(monitor, index) {{
+                        const option = document.createElement('option');
+                        option.value = index;
+                        option.textContent = '显示器 ' + (index + 1) + ' (' + monitor.width + 'x' + monitor.height + ')';
+                        monitorSelect.appendChild(option);
+                    }});
+                    updateMonitorSelect();
+                }});
+            }}
+
+            function resetViewport() {{
+                applyViewport(primaryViewport);
+            }}
+
+            monitorSelect.addEventListener('change', function() {{
+                if (monitorSelect.value === '') {{
+                    resetViewport();
+                }} else {{
+                    applyViewport(monitors[parseInt(monitorSelect.value)]);
+                }}
+            }});
+
+            video.addEventListener('wheel', function(event) {{
+                if (!event.ctrlKey) {{
+                    return;
+                }}
+                event.preventDefault();
+                // 以鼠标所在位置为中心缩放查看区域
+                const factor = event.deltaY < 0 ? 0.8 : 1.25;
+                const pointX = screenLeft + event.offsetX * screenWidth / video.offsetWidth;
+                const pointY = screenTop + event.offsetY * screenHeight / video.offsetHeight;
+                const newWidth = Math.min(monitorBounds.width, Math.max(64, Math.round(screenWidth * factor)));
+                const newHeight = Math.min(monitorBounds.height, Math.max(64, Math.round(screenHeight * factor)));
+                let newLeft = Math.round(pointX - (pointX - screenLeft) * newWidth / screenWidth);
+                let newTop = Math.round(pointY - (pointY - screenTop) * newHeight / screenHeight);
+                newLeft = Math.min(Math.max(newLeft, monitorBounds.x), monitorBounds.x + monitorBounds.width - newWidth);
+                newTop = Math.min(Math.max(newTop, monitorBounds.y), monitorBounds.y + monitorBounds.height - newHeight);
+                applyViewport({{x: newLeft, y: newTop, width: newWidth, height: newHeight}});
+            }});
+
+            loadViewport();
+
             {touch_events}
+
+            {stream_script}
         </script>
     """))
 
@@ -850,7 +2627,9 @@ def computer_info():
 
 @app.route('/camera_view')
 def camera_view():
-    status = camera_status_queue.get() if not camera_status_queue.empty() else "未知状态"
+    # 打开页面即开始准备摄像头，空闲宽限期内视频流连接时无需再次打开
+    camera_processor.start()
+    status = camera_processor.status
     return render_template_string(generate_html_template("摄像头查看", f"""
         <div class="text-center">
             <h2>摄像头查看</h2>
@@ -899,18 +2678,867 @@ def file_upload():
     """))
 
 
+@app.route('/latency_test')
+def latency_test():
+    x, y, width, height = get_screen_viewport()
+    return render_template_string(generate_html_template("延迟测试", f"""
+        <div class="text-center">
+            <h2>延迟测试</h2>
+            <p class="text-muted">向目标位置发送带时间戳的输入，测量从浏览器发出到画面变化被发送出去的时间。
+                请选择一个点击或按键后画面会变化的位置。</p>
+            <div class="row g-2 justify-content-center mt-3">
+                <div class="col-auto">
+                    <select id="probe-action" class="form-select">
+                        <option value="click">鼠标点击</option>
+                        <option value="key">键盘按键</option>
+                    </select>
+                </div>
+                <div class="col-auto"><input type="number" id="probe-x" class="form-control" placeholder="X" value="{x + width // 2}"></div>
+                <div class="col-auto"><input type="number" id="probe-y" class="form-control" placeholder="Y" value="{y + height // 2}"></div>
+                <div class="col-auto"><input type="text" id="probe-key" class="form-control" placeholder="按键" value="a"></div>
+                <div class="col-auto"><input type="number" id="probe-count" class="form-control" placeholder="次数" value="20"></div>
+                <div class="col-auto"><input type="number" id="probe-interval" class="form-control" placeholder="间隔(毫秒)" value="500"></div>
+                <div class="col-auto"><button onclick="runProbes()" class="btn btn-primary">开始测试</button></div>
+                <div class="col-auto"><button onclick="resetStats()" class="btn btn-secondary">清空统计</button></div>
+            </div>
+            <img src="/video_stream" class="img-fluid mt-3" style="max-height: 240px;">
+            <pre id="latency-output" class="bg-dark text-white p-3 mt-3 text-start"></pre>
+        </div>
+        <script>
+            const latencyOutput = document.getElementById('latency-output');
+            const stageNames = {{
+                request_transit: '请求传输', injection: '输入注入', capture_wait: '等待截图',
+                encode: '编码', delivery: '发送', total: '总计'
+            }};
+
+            async function estimateClockOffset() {{
+                // 取往返时间最短的一次估计服务器与浏览器的时钟偏差
+                let best = null;
+                for (let i = 0; i < 5; i++) {{
+                    const start = Date.now();
+                    const data = await (await fetch('/server_time')).json();
+                    const end = Date.now();
+                    if (best === null || end - start < best.rtt) {{
+                        best = {{rtt: end - start, offset: data.time - (start + end) / 2}};
+                    }}
+                }}
+                return best.offset;
+            }}
+
+            async function runProbes() {{
+                const action = document.getElementById('probe-action').value;
+                const targetX = parseInt(document.getElementById('probe-x').value);
+                const targetY = parseInt(document.getElementById('probe-y').value);
+                const key = document.getElementById('probe-key').value;
+                const count = parseInt(document.getElementById('probe-count').value);
+                const interval = parseInt(document.getElementById('probe-interval').value);
+                const viewport = (await (await fetch('/get_viewport')).json()).viewport;
+                const offset = await estimateClockOffset();
+                for (let i = 0; i < count; i++) {{
+                    const probe = {{id: Date.now() + '-' + i, sent_at: Date.now() + offset}};
+                    if (action === 'click') {{
+                        await fetch('/mouse_click', {{
+                            method: 'POST',
+                            headers: {{
+                                'Content-Type': 'application/json'
+                            }},
+                            body: JSON.stringify({{x: targetX - viewport.x, y: targetY - viewport.y, scale_x: 1, scale_y: 1, click_type: '左键', probe: probe}})
+                        }});
+                    }} else {{
+                        probe.region = [targetX - 100, targetY - 20, 200, 40];
+                        await fetch('/keyboard_press', {{
+                            method: 'POST',
+                            headers: {{
+                                'Content-Type': 'application/json'
+                            }},
+                            body: JSON.stringify({{key: key, probe: probe}})
+                        }});
+                    }}
+                    await new Promise(resolve => setTimeout(resolve, interval));
+                    showStats();
+                }}
+            }}
+
+            function resetStats() {{
+                fetch('/reset_latency_stats', {{method: 'POST'}}).then(showStats);
+            }}
+
+            function showStats() {{
+                fetch('/latency_stats')
+               .then(response => response.json())
+               .then(data => {{
+                    let text = '阶段\t\t次数\t平均\tP50\tP90\tP99 (毫秒)\n';
+                    for (const stage in stageNames) {{
+                        const histogram = data.histograms[stage];
+                        text += stageNames[stage] + '\t\t' + histogram.count + '\t' + histogram.avg + '\t' +
+                            histogram.p50 + '\t' + histogram.p90 + '\t' + histogram.p99 + '\n';
+                    }}
+                    text += '\n超时: ' + data.timeouts + '  等待中: ' + data.pending + '\n';
+                    latencyOutput.textContent = text;
+                }});
+            }}
+
+            showStats();
+        </script>
+    """))
+
+
+class UpstreamConnectionPool:
+    # 到一个被控端的持久连接池；被控端声明关闭连接时(如开发服务器)下次请求再新建连接
+    def __init__(self, url, size=GATEWAY_POOL_SIZE):
+        self.target = urlparse(url)
+        self.idle = LifoQueue(maxsize=size)
+
+    def connect(self, timeout=GATEWAY_REQUEST_TIMEOUT):
+        return http.client.HTTPConnection(self.target.hostname, self.target.port, timeout=timeout)
+
+    def open(self, method, path, body=None, headers=None, timeout=GATEWAY_REQUEST_TIMEOUT, replayable=True):
+        # 发送请求并返回 (连接, 响应)，调用方读完响应后用 release() 归还连接；
+        # 请求体是边读边发送的流时无法重发，总是使用新连接且不重试
+        for attempt in range(2):
+            connection, reused = None, False
+            if replayable:
+                try:
+                    connection, reused = self.idle.get_nowait(), True
+                except Empty:
+                    pass
+            if connection is None:
+                connection = self.connect(timeout)
+            else:
+                connection.timeout = timeout
+                if connection.sock:
+                    connection.sock.settimeout(timeout)
+            try:
+                connection.request(method, path, body=body, headers=headers or {})
+                return connection, connection.getresponse()
+            except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+                # 复用的空闲连接可能已被被控端关闭: 请求发送失败或被控端未返回任何数据就断开连接时，
+                # 被控端没有处理该请求，换一个新连接重试一次；超时等其他错误时被控端可能已执行请求(如命令)，不能重试
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                raise
+
+    def release(self, connection, response):
+        # 响应已读完且被控端没有要求关闭时放回空闲连接
+        if response.will_close or not response.isclosed():
+            connection.close()
+            return
+        try:
+            self.idle.put_nowait(connection)
+        except Full:
+            connection.close()
+
+    def read(self, connection, response):
+        # 读出完整响应体并归还连接
+        try:
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            raise
+        self.release(connection, response)
+        return data
+
+    def request(self, method, path, body=None, headers=None, timeout=GATEWAY_REQUEST_TIMEOUT):
+        connection, response = self.open(method, path, body, headers, timeout)
+        data = self.read(connection, response)
+        return response.status, response.getheader('Content-Type', 'application/octet-stream'), data
+
+    def stream(self, connection, response, chunk_size=64 * 1024):
+        # 边读边转发响应体，读完后归还连接；操作者中途断开或被控端出错时关闭连接
+        completed = False
+        try:
+            for chunk in iter(lambda: response.read(chunk_size), b''):
+                yield chunk
+            completed = True
+        except (http.client.HTTPException, OSError) as error:
+            logger.warning(f"转发 {self.target.netloc} 的响应中断: {error}")
+        finally:
+            if completed:
+                self.release(connection, response)
+            else:
+                connection.close()
+
+
+class StreamRelay:
+    # 每个被控端的每条流只建立一个上游连接，把收到的每条消息(一帧图像或一个事件)分发给所有订阅者；
+    # 订阅者只取最新消息，慢速操作者不会拖慢上游和其他操作者；最后一个订阅者离开后断开上游连接
+    def __init__(self, pool, path, event_stream=False):
+        self.pool = pool
+        self.path = path
+        self.event_stream = event_stream
+        self.condition = Condition()
+        self.message = None
+        self.message_at = None
+        self.sequence = 0
+        self.subscribers = 0
+        self.thread = None
+        self.error = None
+
+    def subscribe(self):
+        with self.condition:
+            self.subscribers += 1
+            if self.thread is None:
+                self.thread = Thread(target=self._relay, daemon=True)
+                self.thread.start()
+
+    def unsubscribe(self):
+        with self.condition:
+            self.subscribers -= 1
+
+    @staticmethod
+    def read_messages(response):
+        if response.getheader('Content-Type', '').startswith('text/event-stream'):
+            lines = []
+            for line in iter(response.readline, b''):
+                lines.append(line)
+                if line in (b'\n', b'\r\n'):
+                    yield b''.join(lines)
+                    lines = []
+            return
+        while True:
+            line = response.readline()
+            if not line:
+                return
+            if line.strip() != b'--frame':
+                continue
+            headers = {}
+            for header in iter(response.readline, b''):
+                if header in (b'\r\n', b'\n'):
+                    break
+                name, _, value = header.partition(b':')
+                headers[name.strip().lower()] = value.strip()
+            if b'content-length' not in headers:
+                raise ValueError("上游视频流缺少 Content-Length")
+            body = response.read(int(headers[b'content-length']))
+            response.readline()
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n'
+                   b'Content-Length: %d\r\n\r\n' % len(body) + body + b'\r\n')
+
+    def _relay(self):
+        while True:
+            connection = self.pool.connect(timeout=30)
+            try:
+                connection.request('GET', self.path)
+                response = connection.getresponse()
+                if response.status != 200:
+                    raise ValueError(f"HTTP {response.status}")
+                for message in self.read_messages(response):
+                    with self.condition:
+                        if self.subscribers <= 0:
+                            self.thread = None
+                            return
+                        self.message = message
+                        self.message_at = time.time()
+                        self.error = None
+                        self.sequence += 1
+                        self.condition.notify_all()
+                self.error = "上游连接已关闭"
+            except Exception as error:
+                self.error = str(error)
+                logger.warning(f"上游流 {self.pool.target.netloc}{self.path} 中断: {error}")
+            finally:
+                connection.close()
+            with self.condition:
+                if self.subscribers <= 0:
+                    self.thread = None
+                    return
+            time.sleep(GATEWAY_RETRY_SECONDS)
+
+    def keepalive_message(self):
+        # 事件流写出注释行；视频流重发最后一帧，还没有画面时写出第一个分隔符之前会被忽略的空行
+        if self.event_stream:
+            return b': keepalive\n\n'
+        return self.message or b'\r\n'
+
+    def generate_messages(self):
+        self.subscribe()
+        try:
+            sequence = 0
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.sequence != sequence, timeout=GATEWAY_KEEPALIVE_SECONDS)
+                    if self.sequence == sequence:
+                        # 上游中断或长时间没有新消息时也定期写出数据，操作者断开后才能察觉并退订
+                        message = self.keepalive_message()
+                    else:
+                        message = self.message
+                        sequence = self.sequence
+                yield message
+        finally:
+            self.unsubscribe()
+
+
+class AgentUpstream:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.name = urlparse(self.url).netloc
+        self.pool = UpstreamConnectionPool(self.url)
+        self.relays = {}
+        self.lock = Lock()
+        # 缩略图流始终保持订阅，同时用于判断被控端是否在线
+        self.snapshot = StreamRelay(self.pool, f"/snapshot_stream?scale={GATEWAY_THUMBNAIL_SCALE}"
+                                               f"&quality={GATEWAY_THUMBNAIL_QUALITY}"
+                                               f"&interval={GATEWAY_THUMBNAIL_INTERVAL}")
+        self.snapshot.subscribe()
+
+    def relay(self, route, query=''):
+        # 路径和查询参数(如查看区域)都相同的操作者共享一个上游连接；顺带清理已无人订阅的转发
+        path = f"/{route}?{query}" if query else f"/{route}"
+        with self.lock:
+            for idle_path in [idle_path for idle_path, relay in self.relays.items()
+                              if relay.subscribers <= 0 and relay.thread is None and idle_path != path]:
+                del self.relays[idle_path]
+            if path not in self.relays:
+                self.relays[path] = StreamRelay(self.pool, path,
+                                                GATEWAY_FANOUT_ROUTES[route].startswith('text/event-stream'))
+            return self.relays[path]
+
+    def thumbnail(self):
+        message = self.snapshot.message
+        return message[message.index(b'\r\n\r\n') + 4:-2] if message else None
+
+    def status(self):
+        relay = self.snapshot
+        online = relay.message_at is not None and time.time() - relay.message_at < 3 * GATEWAY_THUMBNAIL_INTERVAL + 5
+        return {
+            'name': self.name,
+            'url': self.url,
+            'online': online,
+            'last_seen': relay.message_at,
+            'error': relay.error,
+            'viewers': {path: relay.subscribers for path, relay in list(self.relays.items()) if relay.subscribers > 0}
+        }
+
+
+gateway_app = Flask('gateway')
+gateway_agents = []
+
+
+def rewrite_agent_page(html, index):
+    # 代理被控端页面时给页面中的站内地址加上 /agents/<编号> 前缀
+    return re.sub(r"""(["'])/(?!/)""", lambda match: f"{match.group(1)}/agents/{index}/", html)
+
+
+@gateway_app.route('/')
+def gateway_home():
+    cards = ''.join(f"""
+        <div class="col">
+            <div class="card h-100">
+                <a href="/agents/{index}/remote_control">
+                    <img id="agent-thumbnail-{index}" src="/agents/{index}/thumbnail" class="card-img-top" alt="{agent.name}">
+                </a>
+                <div class="card-body p-2">
+                    <a href="/agents/{index}/" class="card-title">{agent.name}</a>
+                    <span id="agent-status-{index}" class="badge bg-secondary ms-2">连接中</span>
+                </div>
+            </div>
+        </div>""" for index, agent in enumerate(gateway_agents))
+    return render_template_string(generate_html_template("远程控制网关", f"""
+        <div class="text-center">
+            <h2>远程控制网关</h2>
+        </div>
+        <div class="row row-cols-2 row-cols-md-3 row-cols-xl-4 g-3 mt-3">
+            {cards}
+        </div>
+        <script>
+            // 缩略图由网关缓存的快照定期刷新，不为每个被控端占用一个长连接(浏览器对同一主机的并发连接数有限)
+            function refreshThumbnail(index) {{
+                const thumbnail = document.getElementById('agent-thumbnail-' + index);
+                const image = new Image();
+                image.onload = function() {{
+                    thumbnail.src = image.src;
+                }};
+                image.src = '/agents/' + index + '/thumbnail?t=' + Date.now();
+            }}
+
+            function refreshStatus() {{
+                fetch('/agents')
+               .then(response => response.json())
+               .then(agents => {{
+                    agents.forEach(function(agent, index) {{
+                        const badge = document.getElementById('agent-status-' + index);
+                        badge.textContent = agent.online ? '在线' : '离线';
+                        badge.className = 'badge ms-2 ' + (agent.online ? 'bg-success' : 'bg-danger');
+                        if (agent.online) {{
+                            refreshThumbnail(index);
+                        }}
+                    }});
+                }});
+            }}
+            refreshStatus();
+            setInterval(refreshStatus, {GATEWAY_THUMBNAIL_INTERVAL * 1000});
+        </script>
+    """, return_button=False, settings_button=False))
+
+
+@gateway_app.route('/agents')
+def gateway_agent_list():
+    return jsonify([agent.status() for agent in gateway_agents])
+
+
+@gateway_app.route('/agents/<int:index>/thumbnail')
+def gateway_thumbnail(index):
+    if index >= len(gateway_agents):
+        return jsonify({"错误": f"被控端不存在: {index}"}), 404
+    thumbnail = gateway_agents[index].thumbnail()
+    if thumbnail is None:
+        return jsonify({"错误": "暂无缩略图"}), 503
+    return Response(thumbnail, mimetype='image/jpeg', headers={'Cache-Control': 'no-cache'})
+
+
+@gateway_app.route('/agents/<int:index>/', defaults={'route': ''}, methods=['GET', 'POST'])
+@gateway_app.route('/agents/<int:index>/<path:route>', methods=['GET', 'POST'])
+def gateway_proxy(index, route):
+    if index >= len(gateway_agents):
+        return jsonify({"错误": f"被控端不存在: {index}"}), 404
+    agent = gateway_agents[index]
+    if route in GATEWAY_FANOUT_ROUTES and request.method == 'GET':
+        return Response(agent.relay(route, request.query_string.decode('utf-8')).generate_messages(),
+                        mimetype=GATEWAY_FANOUT_ROUTES[route],
+                        headers={'Cache-Control': 'no-cache'})
+    if route == 'screen_tile_stream':
+        # 图块流按客户端记录已发送的图块，无法在操作者之间共享
+        return jsonify({"错误": "网关不转发图块流，请使用 /video_stream"}), 404
+    query = request.query_string.decode('utf-8')
+    if route == 'remote_control':
+        query = 'mode=mjpeg'
+    path = f"/{route}?{query}" if query else f"/{route}"
+    headers = {'Content-Type': request.content_type} if request.content_type else {}
+    # 小请求体先读入内存，复用的连接失效时可以重发；大文件上传等请求体边收边转发，不在网关内缓存
+    streamed = ((request.content_length or 0) > GATEWAY_BUFFER_BYTES or
+                request.headers.get('Transfer-Encoding', '').lower() == 'chunked')
+    if streamed:
+        body = request.stream
+        if request.content_length:
+            headers['Content-Length'] = str(request.content_length)
+    else:
+        body = request.get_data() or None
+    try:
+        connection, response = agent.pool.open(request.method, path, body=body, headers=headers,
+                                               timeout=GATEWAY_ROUTE_TIMEOUTS.get(route, GATEWAY_REQUEST_TIMEOUT),
+                                               replayable=not streamed)
+        content_type = response.getheader('Content-Type', 'application/octet-stream')
+        if content_type.startswith('text/html'):
+            data = agent.pool.read(connection, response)
+            data = rewrite_agent_page(data.decode('utf-8'), index).encode('utf-8')
+            return Response(data, status=response.status, content_type=content_type)
+    except (http.client.HTTPException, OSError) as error:
+        logger.error(f"转发请求到 {agent.name}{path} 失败: {error}")
+        return jsonify({"错误": f"无法连接被控端 {agent.name}: {error}"}), 502
+    response_headers = {'Content-Length': response.getheader('Content-Length')} \
+        if response.getheader('Content-Length') else {}
+    return Response(agent.pool.stream(connection, response), status=response.status, content_type=content_type,
+                    headers=response_headers)
+
+
+def start_gateway(agent_urls):
+    gateway_agents.extend(AgentUpstream(url) for url in agent_urls)
+    logger.info(f"网关模式: 管理 {len(gateway_agents)} 个被控端")
+    gateway_app.run(debug=False, host='0.0.0.0', port=SERVER_PORT, threaded=True,
+                    request_handler=KeepAliveRequestHandler)
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    # Werkzeug 开发服务器对每个响应都发送 Connection: close，并在响应后读光连接上的剩余数据，
+    # 网关的连接池因此无法复用连接；这里启用 HTTP/1.1 持久连接，按 Content-Length 读完请求体后
+    # 继续在同一连接上处理下一个请求，流式(分块传输)响应和分块上传的请求仍在结束后关闭连接
+    protocol_version = 'HTTP/1.1'
+
+    def make_environ(self):
+        environ = super().make_environ()
+        if environ['wsgi.input'] is self.rfile:
+            self.request_body = LimitedStream(self.rfile, int(self.headers.get('Content-Length') or 0))
+            environ['wsgi.input'] = self.request_body
+            environ['wsgi.input_terminated'] = True
+            # 请求体已交给应用，Werkzeug 响应后的清理读取只能读到空数据，不会吞掉下一个请求
+            self.rfile = io.BytesIO()
+        else:
+            self.close_connection = True
+        return environ
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'transfer-encoding' and value.lower() == 'chunked':
+            self.close_connection = True
+        if keyword.lower() == 'connection' and value.lower() == 'close' and not self.close_connection:
+            return
+        super().send_header(keyword, value)
+
+    def run_wsgi(self):
+        connection_rfile = self.rfile
+        self.request_body = None
+        try:
+            super().run_wsgi()
+        finally:
+            self.rfile = connection_rfile
+        if self.request_body is not None and not self.close_connection:
+            self.request_body.exhaust()
+
+
 def start_flask_server():
-    app.run(debug=False, host='0.0.0.0', port=5000)
+    app.run(debug=False, host='0.0.0.0', port=SERVER_PORT, request_handler=KeepAliveRequestHandler)
 
 
 def start_gui():
     global root
     root = tk.Tk()
     root.title("远程桌面 by明磊")
-    tk.Label(root, text="服务已启动，访问 http://localhost:5000 查看。").pack(pady=20)
+    tk.Label(root, text=f"服务已启动，访问 http://localhost:{SERVER_PORT} 查看。").pack(pady=20)
     root.mainloop()
 
 
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 2)
+
+
+def summarize_samples(values):
+    return {
+        'p50': percentile(values, 0.5),
+        'p90': percentile(values, 0.9),
+        'p99': percentile(values, 0.99),
+        'max': round(max(values), 2) if values else None
+    }
+
+
+def consume_mjpeg_stream(target, path, duration, read_delay, result):
+    # 读取 MJPEG 流并记录每帧到达时间；read_delay 大于 0 时模拟慢速客户端
+    boundary = b'--frame\r\n'
+    connection = http.client.HTTPConnection(target.hostname, target.port, timeout=10)
+    frame_times = []
+    received = 0
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        deadline = time.time() + duration
+        tail = b''
+        while time.time() < deadline:
+            chunk = response.read1(16384)
+            if not chunk:
+                break
+            received += len(chunk)
+            data = tail + chunk
+            now = time.time()
+            frame_times.extend([now] * data.count(boundary))
+            tail = data[-(len(boundary) - 1):]
+            if read_delay:
+                time.sleep(read_delay)
+    except Exception as error:
+        result['error'] = str(error)
+    finally:
+        connection.close()
+    gaps = [(later - earlier) * 1000 for earlier, later in zip(frame_times, frame_times[1:])]
+    span = frame_times[-1] - frame_times[0] if len(frame_times) > 1 else 0
+    result.update({
+        'frames': len(frame_times),
+        'fps': round((len(frame_times) - 1) / span, 2) if span else 0,
+        'bytes': received,
+        'frame_gap_ms': summarize_samples(gaps)
+    })
+
+
+def send_input_events(target, duration, rate, result):
+    # 交替发送鼠标点击和键盘输入请求，记录每个请求的往返时间
+    connection = http.client.HTTPConnection(target.hostname, target.port, timeout=10)
+    latencies = []
+    errors = 0
+    deadline = time.time() + duration
+    index = 0
+    while time.time() < deadline:
+        start_time = time.time()
+        if index % 2 == 0:
+            path, body = '/mouse_click', {'x': 50 + index % 400, 'y': 50 + index % 300, 'scale_x': 1, 'scale_y': 1,
+                                          'click_type': '左键'}
+        else:
+            path, body = '/keyboard_press', {'key': 'a'}
+        try:
+            connection.request('POST', path, body=json.dumps(body), headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+            latencies.append((time.time() - start_time) * 1000)
+            if response.getheader('Connection', '').lower() == 'close' or response.version == 10:
+                connection.close()
+        except Exception:
+            errors += 1
+            connection.close()
+        index += 1
+        time.sleep(max(0, (1.0 / rate) - (time.time() - start_time)))
+    connection.close()
+    result.update({'requests': len(latencies), 'errors': errors, 'latency_ms': summarize_samples(latencies)})
+
+
+def monitor_server_process(pid, duration, samples):
+    process = psutil.Process(pid)
+    process.cpu_percent(None)
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        time.sleep(1)
+        try:
+            samples.append({
+                'cpu_percent': process.cpu_percent(None),
+                'rss_mb': process.memory_info().rss / 1024 / 1024,
+                'threads': process.num_threads()
+            })
+        except psutil.NoSuchProcess:
+            break
+
+
+def run_load_test(args):
+    # 在本地启动一个使用合成桌面和合成摄像头的服务器(或使用 --target 指定的服务器)，
+    # 模拟多个视频流观看者和输入事件发送者，输出各客户端帧率、帧间隔分位数、输入延迟分位数和服务器资源占用
+    server = None
+    if args.target:
+        target = urlparse(args.target)
+    else:
+        target = urlparse(f"http://127.0.0.1:{args.port}")
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--headless', '--synthetic',
+                                   '--port', str(args.port)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            try:
+                connection = http.client.HTTPConnection(target.hostname, target.port, timeout=1)
+                connection.request('GET', '/server_time')
+                connection.getresponse().read()
+                connection.close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError(f"无法连接服务器: {target.geturl()}")
+
+        threads = []
+        viewers = []
+        for index in range(args.viewers + args.camera_viewers):
+            path = '/video_stream' if index < args.viewers else '/camera_stream'
+            # 每种流中最前面的 slow_viewers 个客户端为慢速客户端
+            slow = (index if index < args.viewers else index - args.viewers) < args.slow_viewers
+            result = {'path': path, 'slow': slow}
+            viewers.append(result)
+            threads.append(Thread(target=consume_mjpeg_stream,
+                                  args=(target, path, args.duration, args.slow_read_delay if slow else 0, result)))
+        senders = []
+        for index in range(args.senders):
+            result = {}
+            senders.append(result)
+            threads.append(Thread(target=send_input_events, args=(target, args.duration, args.event_rate, result)))
+        server_samples = []
+        if server:
+            threads.append(Thread(target=monitor_server_process, args=(server.pid, args.duration, server_samples)))
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(args.duration + 15)
+
+        report = {'target': target.geturl(), 'duration': args.duration, 'viewers': viewers, 'senders': senders}
+        if server_samples:
+            report['server'] = {
+                'cpu_percent': summarize_samples([sample['cpu_percent'] for sample in server_samples]),
+                'rss_mb': summarize_samples([sample['rss_mb'] for sample in server_samples]),
+                'threads': summarize_samples([sample['threads'] for sample in server_samples])
+            }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        print(output)
+        if args.report:
+            with open(args.report, 'w', encoding='utf-8') as report_file:
+                report_file.write(output)
+        return report
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+
+def compute_delta(local_path, blocks, block_size, window=1024 * 1024):
+    # 用 numpy 一次算出窗口内所有偏移处的滚动校验和，只在弱校验和命中的偏移上比较强校验和；
+    # 返回 recipe 和需要上传的字面数据区间
+    strong_by_weak = {}
+    for index, (weak, strong) in enumerate(blocks):
+        strong_by_weak.setdefault(weak, {}).setdefault(strong, index)
+    known_weak = np.array(sorted(strong_by_weak), dtype=np.int64)
+    size = os.path.getsize(local_path)
+    recipe = []
+    literals = []
+
+    def add_literal(start, end):
+        if end > start:
+            recipe.append(['data', end - start])
+            literals.append((start, end))
+
+    def add_copy(index):
+        if recipe and recipe[-1][0] == 'copy' and recipe[-1][1] + recipe[-1][2] == index:
+            recipe[-1][2] += 1
+        else:
+            recipe.append(['copy', index, 1])
+
+    if size == 0:
+        return recipe, literals
+    data = np.memmap(local_path, dtype=np.uint8, mode='r')
+    cursor = literal_start = 0
+    position = 0
+    while known_weak.size and position + block_size <= size:
+        end = min(position + window, size - block_size + 1)
+        segment = data[position:end + block_size - 1].astype(np.int64)
+        sums = np.concatenate(([0], np.cumsum(segment)))
+        weighted = np.concatenate(([0], np.cumsum(segment * np.arange(len(segment)))))
+        offsets = np.arange(end - position)
+        a = sums[offsets + block_size] - sums[offsets]
+        b = (offsets + block_size) * a - (weighted[offsets + block_size] - weighted[offsets])
+        weak = (a % 65536) | ((b % 65536) << 16)
+        for offset in np.nonzero(np.isin(weak, known_weak))[0]:
+            start = position + int(offset)
+            if start < cursor:
+                continue
+            index = strong_by_weak[int(weak[offset])].get(strong_checksum(data[start:start + block_size].tobytes()))
+            if index is not None:
+                add_literal(literal_start, start)
+                add_copy(index)
+                cursor = literal_start = start + block_size
+        position = max(cursor, end)
+
+    # 末尾不足一块的数据与旧文件的最后一块比较
+    tail = size - literal_start
+    if blocks and 0 < tail < block_size and \
+            blocks[-1][1] == strong_checksum(data[literal_start:size].tobytes()):
+        add_copy(len(blocks) - 1)
+        literal_start = size
+    add_literal(literal_start, size)
+    return recipe, literals
+
+
+def read_push_response(connection, action):
+    # 先检查状态码再解析，服务器或代理返回的错误页不一定是 JSON
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    if response.status != 200:
+        try:
+            message = json.loads(body).get('错误')
+        except (ValueError, AttributeError):
+            message = body[:200].decode('utf-8', 'replace')
+        logger.error(f"{action}失败 ({response.status}): {message}")
+        sys.exit(1)
+    return json.loads(body)
+
+
+def push_file(args):
+    # 增量同步本地文件到服务器上传目录: 先获取服务器上旧文件的分块校验和，只上传变化的部分
+    target = urlparse(args.target or f"http://127.0.0.1:{args.port}")
+    remote_name = args.remote_name or os.path.basename(args.push)
+    block_size = args.block_size
+    connection = http.client.HTTPConnection(target.hostname, target.port, timeout=60)
+    connection.request('GET', f"/upload_signature?path={quote(remote_name)}&block_size={block_size}")
+    signature = read_push_response(connection, '获取分块校验和')
+
+    recipe, literals = compute_delta(args.push, signature['blocks'], block_size)
+    digest = hashlib.sha256()
+    with open(args.push, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+
+    boundary = uuid.uuid4().hex
+    fields = {'path': remote_name, 'block_size': str(block_size), 'recipe': json.dumps(recipe),
+              'sha256': digest.hexdigest()}
+    head = b''.join(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+                    for name, value in fields.items())
+    head += (f'--{boundary}\r\nContent-Disposition: form-data; name="data"; filename="data"\r\n'
+             f'Content-Type: application/octet-stream\r\n\r\n').encode('utf-8')
+    foot = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    literal_size = sum(end - start for start, end in literals)
+
+    def generate_body():
+        yield head
+        with open(args.push, 'rb') as file:
+            for start, end in literals:
+                file.seek(start)
+                remaining = end - start
+                while remaining > 0:
+                    chunk = file.read(min(remaining, 1024 * 1024))
+                    remaining -= len(chunk)
+                    yield chunk
+        yield foot
+
+    connection = http.client.HTTPConnection(target.hostname, target.port, timeout=600)
+    connection.request('POST', '/upload_delta', body=generate_body(), headers={
+        'Content-Type': f'multipart/form-data; boundary={boundary}',
+        'Content-Length': str(len(head) + literal_size + len(foot))
+    })
+    result = read_push_response(connection, '上传增量')
+    print(json.dumps(result, ensure_ascii=False))
+    return result
+
+
+def is_display_available():
+    if platform.system() == 'Linux':
+        return bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+    return True
+
+
 if __name__ == '__main__':
-    Thread(target=start_flask_server, daemon=True).start()
-    start_gui()
+    parser = argparse.ArgumentParser(description='磊牌远程控制')
+    parser.add_argument('--headless', action='store_true', help='不启动图形界面，适用于没有显示器的服务器')
+    parser.add_argument('--camera-idle-timeout', type=float, default=CAMERA_IDLE_RELEASE_SECONDS,
+                        help='最后一个观看者离开后保留摄像头的时间(秒)')
+    parser.add_argument('--synthetic', action='store_true', help='使用合成桌面和合成摄像头代替真实设备')
+    parser.add_argument('--camera-monitor', action='store_true', help='没有观看者时也保持摄像头打开并记录运动事件')
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help='服务端口')
+    parser.add_argument('--target', help='压力测试或文件同步的服务器地址，如 http://host:5000')
+    load_test_group = parser.add_argument_group('压力测试')
+    load_test_group.add_argument('--load-test', action='store_true',
+                                 help='运行压力测试而不是启动服务，未指定 --target 时在本地启动合成设备服务器')
+    load_test_group.add_argument('--viewers', type=int, default=4, help='屏幕视频流观看者数量')
+    load_test_group.add_argument('--camera-viewers', type=int, default=2, help='摄像头视频流观看者数量')
+    load_test_group.add_argument('--slow-viewers', type=int, default=1, help='每种视频流中慢速观看者的数量')
+    load_test_group.add_argument('--slow-read-delay', type=float, default=0.2, help='慢速观看者每次读取后的等待时间(秒)')
+    load_test_group.add_argument('--senders', type=int, default=2, help='输入事件发送者数量')
+    load_test_group.add_argument('--event-rate', type=float, default=10, help='每个发送者每秒发送的输入事件数')
+    load_test_group.add_argument('--duration', type=float, default=20, help='压力测试持续时间(秒)')
+    load_test_group.add_argument('--report', help='将压力测试结果另存为 JSON 文件')
+    parser.add_argument('--encode-workers', type=int, default=0,
+                        help='屏幕视频流、屏幕图块流和摄像头视频流的编码工作进程数，通过共享内存传递画面；0 表示在服务进程内编码')
+    gateway_group = parser.add_argument_group('网关')
+    gateway_group.add_argument('--gateway', action='store_true', help='以网关模式运行，汇总多个被控端')
+    gateway_group.add_argument('--agents', default='', help='被控端地址列表，用逗号分隔，如 http://host1:5000,http://host2:5000')
+    sync_group = parser.add_argument_group('文件同步')
+    sync_group.add_argument('--push', help='将本地文件增量同步到服务器的上传目录')
+    sync_group.add_argument('--remote-name', help='服务器上传目录中的目标路径，默认与本地文件同名')
+    sync_group.add_argument('--block-size', type=int, default=DELTA_BLOCK_SIZE, help='增量同步的分块大小(字节)')
+    args = parser.parse_args()
+    CAMERA_IDLE_RELEASE_SECONDS = args.camera_idle_timeout
+    SERVER_PORT = args.port
+    if args.load_test:
+        run_load_test(args)
+        sys.exit(0)
+    if args.push:
+        push_file(args)
+        sys.exit(0)
+    if args.gateway:
+        start_gateway([url for url in args.agents.split(',') if url.strip()])
+        sys.exit(0)
+    if args.synthetic:
+        use_synthetic_devices()
+    if args.encode_workers > 0:
+        start_frame_bus(args.encode_workers)
+    if args.camera_monitor:
+        camera_processor.hold()
+
+    if args.headless or not is_display_available():
+        logger.info("以无界面模式运行")
+        start_flask_server()
+    else:
+        server_thread = Thread(target=start_flask_server, daemon=True)
+        server_thread.start()
+        try:
+            start_gui()
+        except Exception as error:
+            logger.error(f"图形界面启动失败，继续以无界面模式运行: {error}")
+            server_thread.join()
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def synthetic_desktop(monkeypatch):
+    # 用合成桌面代替真实的截图和输入注入
+    desktop = main.SyntheticDesktop()
+    monkeypatch.setattr(main, 'pyautogui', desktop)
+    monkeypatch.setattr(main, 'ImageGrab', desktop)
+    return desktop
@@ -0,0 +1,97 @@
+import sys
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+
+@pytest.mark.parametrize('payload', [
+    {'commands': ['echo hi'], 'timeout': 0},
+    {'commands': ['echo hi'], 'timeout': -1},
+    {'commands': [{'command': 'echo hi', 'timeout': 0}]},
+    {'commands': [{'command': 'echo hi', 'timeout': 'nan'}]},
+])
+def test_non_positive_timeout_is_rejected(client, payload):
+    assert client.post('/execute_batch', json=payload).status_code == 400
+
+
+def test_store_full_of_unfinished_jobs_rejects_new_jobs(client, monkeypatch):
+    monkeypatch.setattr(main, 'BATCH_MAX_JOBS', 2)
+    monkeypatch.setattr(main, 'batch_jobs', main.BatchJobStore())
+    command = f'"{sys.executable}" -c "import time; time.sleep(0.5)"'
+    for _ in range(2):
+        assert client.post('/execute_batch', json={'commands': [command]}).status_code == 200
+    response = client.post('/execute_batch', json={'commands': [command]})
+    assert response.status_code == 503
+    assert len(main.batch_jobs.jobs) == 2
+
+    deadline = time.time() + 10
+    while any(job['status'] != 'finished' for job in main.batch_jobs.list_jobs()) and time.time() < deadline:
+        time.sleep(0.05)
+    # 已完成的任务会被清理，为新任务腾出位置
+    assert client.post('/execute_batch', json={'commands': ['echo hi']}).status_code == 200
+    assert len(main.batch_jobs.jobs) == 2
+
+
+def wait_for_jobs(store, job_ids, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        jobs = [store.get(job_id) for job_id in job_ids]
+        if all(job['status'] == 'finished' for job in jobs):
+            return jobs
+        time.sleep(0.05)
+    raise AssertionError('批量任务未在规定时间内完成')
+
+
+def test_jobs_interleave_instead_of_queueing_behind_a_large_job(monkeypatch):
+    monkeypatch.setattr(main, 'BATCH_MAX_WORKERS', 2)
+    store = main.BatchJobStore()
+    sleep = f'"{sys.executable}" -c "import time; time.sleep(0.3)"'
+    large = store.submit([(sleep, 10)] * 8, 2)
+    small = store.submit([('echo small', 10)], 1)
+    large_job, small_job = wait_for_jobs(store, [large, small])
+    # 小任务在大任务的第一批命令结束后就能运行，而不是排在大任务所有命令之后
+    small_elapsed = small_job['finished_at'] - small_job['created_at']
+    large_elapsed = large_job['finished_at'] - large_job['created_at']
+    assert small_elapsed < large_elapsed / 2
+    assert [result['status'] for result in large_job['results']] == ['finished'] * 8
+
+
+def test_job_parallelism_limits_concurrent_commands(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, 'BATCH_MAX_WORKERS', 4)
+    store = main.BatchJobStore()
+    # 每条命令运行期间在目录中留下一个标记文件，并记录启动时同时存在的标记数
+    script = ("import os, sys, time; d = sys.argv[1]; p = os.path.join(d, str(os.getpid())); "
+              "open(p, 'w').close(); print(len(os.listdir(d))); time.sleep(0.3); os.remove(p)")
+    command = f'"{sys.executable}" -c "{script}" "{tmp_path}"'
+    job_id = store.submit([(command, 10)] * 6, 2)
+    job, = wait_for_jobs(store, [job_id])
+    assert max(int(result['stdout']) for result in job['results']) <= 2
+
+
+def test_output_beyond_the_limit_is_dropped(monkeypatch):
+    monkeypatch.setattr(main, 'BATCH_OUTPUT_LIMIT', 1000)
+    store = main.BatchJobStore()
+    command = f'"{sys.executable}" -c "import sys; sys.stdout.write(\'x\' * 200000); sys.stderr.write(\'err\')"'
+    job_id = store.submit([(command, 10)], 1)
+    job, = wait_for_jobs(store, [job_id])
+    result = job['results'][0]
+    assert result['stdout'] == 'x' * 1000
+    assert result['stderr'] == 'err'
+    assert result['truncated'] is True
+
+
+def test_timeout_kills_command_and_keeps_partial_output():
+    store = main.BatchJobStore()
+    command = f'"{sys.executable}" -u -c "import time; print(\'started\'); time.sleep(30)"'
+    job_id = store.submit([(command, 0.5)], 1)
+    job, = wait_for_jobs(store, [job_id], timeout=10)
+    result = job['results'][0]
+    assert result['status'] == 'timeout'
+    assert result['stdout'].strip() == 'started'
@@ -0,0 +1,121 @@
+import threading
+import time
+
+import main
+
+
+def test_exiting_thread_leaves_newer_capture_thread_alone():
+    processor = main.CameraProcessor()
+    newer_thread = threading.Thread(target=lambda: None)
+    newer_camera = main.SyntheticCamera()
+    processor.thread = newer_thread
+    # 旧线程退出时新的采集线程已经启动并打开了摄像头
+    processor.open_camera = lambda: False
+    processor.camera = newer_camera
+    processor._capture_frames()
+    assert processor.thread is newer_thread
+    assert processor.camera is newer_camera
+
+
+def test_camera_is_released_after_idle_and_reopened_for_next_viewer(monkeypatch):
+    monkeypatch.setattr(main, 'CAMERA_IDLE_RELEASE_SECONDS', 0.2)
+    processor = main.CameraProcessor()
+    processor.camera_factory = main.SyntheticCamera
+    for _ in range(2):
+        frames = processor.generate_camera_frames()
+        assert next(frames).startswith(b'--frame')
+        frames.close()
+        deadline = time.time() + 5
+        while processor.thread is not None and time.time() < deadline:
+            time.sleep(0.05)
+        assert processor.thread is None
+        assert processor.camera is None
+
+
+def camera_frame(camera, elapsed):
+    # 合成摄像头按启动后的时间决定方块位置: 每 20 秒中前 5 秒方块移动，其余时间只有噪声
+    camera.started_at = time.time() - elapsed
+    return camera.read()[1]
+
+
+def test_static_noisy_frames_never_set_active():
+    detector = main.MotionDetector()
+    camera = main.SyntheticCamera()
+    for _ in range(50):
+        assert not detector.update(camera_frame(camera, 10))
+    assert not detector.events
+
+
+def test_moving_block_sets_active():
+    detector = main.MotionDetector()
+    camera = main.SyntheticCamera()
+    detector.update(camera_frame(camera, 10))
+    assert any(detector.update(camera_frame(camera, step * 0.5)) for step in range(1, 6))
+    assert detector.to_dict()['active']
+    assert len(detector.events) == 1
+
+
+def test_event_ends_after_hold(monkeypatch):
+    monkeypatch.setattr(main, 'MOTION_HOLD_SECONDS', 0.3)
+    detector = main.MotionDetector()
+    camera = main.SyntheticCamera()
+    detector.update(camera_frame(camera, 10))
+    for step in range(1, 6):
+        detector.update(camera_frame(camera, step * 0.5))
+    event = detector.events[-1]
+    assert event['start'] is not None and event['end'] is None
+
+    # 运动停止后在保持时间内仍视为运动
+    assert detector.update(camera_frame(camera, 10))
+    time.sleep(0.35)
+    assert not detector.update(camera_frame(camera, 10))
+    assert event['end'] == detector.last_motion
+    assert event['start'] <= event['end']
+    assert event['peak_score'] >= main.MOTION_AREA_THRESHOLD
+
+
+def count_published_frames(monkeypatch, elapsed, duration=1.5):
+    monkeypatch.setattr(main, 'CAMERA_FRAME_RATE', 20)
+    monkeypatch.setattr(main, 'CAMERA_IDLE_FRAME_RATE', 2)
+    monkeypatch.setattr(main, 'MOTION_HOLD_SECONDS', 0.2)
+    monkeypatch.setattr(main, 'CAMERA_IDLE_RELEASE_SECONDS', 0)
+    processor = main.CameraProcessor()
+
+    def open_synthetic_camera():
+        camera = main.SyntheticCamera()
+        camera.started_at = time.time() - elapsed
+        return camera
+
+    processor.camera_factory = open_synthetic_camera
+    frames = processor.generate_camera_frames()
+    next(frames)
+    count = 0
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        next(frames)
+        count += 1
+    frames.close()
+    return count
+
+
+def test_publishing_drops_to_idle_frame_rate_while_still(monkeypatch):
+    still = count_published_frames(monkeypatch, elapsed=6)
+    moving = count_published_frames(monkeypatch, elapsed=0)
+    assert still <= 5
+    assert moving >= 15
+
+
+def test_camera_motion_filters_events_by_since(monkeypatch):
+    detector = main.MotionDetector()
+    detector.events.extend([{'start': 100.0, 'end': 110.0, 'peak_score': 0.2},
+                            {'start': 200.0, 'end': 210.0, 'peak_score': 0.3},
+                            {'start': 300.0, 'end': None, 'peak_score': 0.4}])
+    monkeypatch.setattr(main.camera_processor, 'motion_detector', detector)
+    client = main.app.test_client()
+    assert len(client.get('/camera_motion').get_json()['events']) == 3
+    events = client.get('/camera_motion?since=150').get_json()['events']
+    assert [event['start'] for event in events] == [200.0, 300.0]
+    # 未结束的事件总是包含在内
+    events = client.get(f'/camera_motion?since={time.time() - 1}').get_json()['events']
+    assert [event['start'] for event in events] == [300.0]
+    assert client.get('/camera_motion?since=abc').status_code == 400
@@ -0,0 +1,53 @@
+import json
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def tracker(synthetic_desktop, monkeypatch):
+    monkeypatch.setattr(main, 'CURSOR_KEEPALIVE_SECONDS', 0.3)
+    return main.CursorTracker()
+
+
+def next_event(events):
+    message = next(events)
+    return json.loads(message[len('data: '):]) if message.startswith('data: ') else message
+
+
+def wait_for_sampler_exit(tracker):
+    deadline = time.time() + 2
+    while tracker.thread is not None and time.time() < deadline:
+        time.sleep(0.01)
+    return tracker.thread is None
+
+
+def test_only_changes_are_pushed(tracker, synthetic_desktop):
+    events = tracker.generate_cursor_events()
+    assert next_event(events) == {'x': 640, 'y': 360, 'shape': 'default'}
+    synthetic_desktop.moveTo(10, 20)
+    assert next_event(events) == {'x': 10, 'y': 20, 'shape': 'default'}
+    # 光标不动时只有保活注释
+    assert next_event(events) == ': keep-alive\n\n'
+    events.close()
+    assert tracker.subscribers == 0
+    assert wait_for_sampler_exit(tracker)
+
+
+def test_sampler_restarts_after_error(tracker, synthetic_desktop, monkeypatch):
+    failures = []
+
+    def position():
+        if not failures:
+            failures.append(True)
+            raise OSError("position unavailable")
+        return 5, 6
+
+    monkeypatch.setattr(synthetic_desktop, 'position', position)
+    events = tracker.generate_cursor_events()
+    assert next_event(events) == ': keep-alive\n\n'
+    assert next_event(events) == {'x': 5, 'y': 6, 'shape': 'default'}
+    events.close()
+    assert wait_for_sampler_exit(tracker)
@@ -0,0 +1,73 @@
+import time
+
+import numpy as np
+import pytest
+
+import main
+
+
+@pytest.fixture
+def bus():
+    bus = main.FrameBus(1, slot_bytes=1024 * 1024)
+    yield bus
+    bus.close()
+
+
+def test_frames_are_encoded_by_workers(bus):
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    encoded = bus.encode(frame, 'RGB', 0.5, 80)
+    assert encoded[:3] == b'\xff\xd8\xff'
+    assert main.cv2.imdecode(np.frombuffer(encoded, np.uint8), main.cv2.IMREAD_COLOR).shape == (60, 80, 3)
+
+
+def test_slot_is_not_reused_until_worker_finishes(bus):
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    # 第一帧等待工作进程启动和导入
+    bus.encode(frame, 'RGB', 1.0, 80)
+    assert bus.encode(frame, 'RGB', 1.0, 80, timeout=0) is None
+    assert bus.free_slots.qsize() == bus.slots - 1
+    deadline = time.time() + 5
+    while bus.free_slots.qsize() < bus.slots and time.time() < deadline:
+        time.sleep(0.01)
+    assert bus.free_slots.qsize() == bus.slots
+    assert bus.waiting == {}
+
+
+def test_dead_worker_disables_bus(bus):
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    assert bus.encode(frame, 'RGB', 1.0, 80) is not None
+    bus.workers[0].kill()
+    bus.workers[0].join()
+    started = time.time()
+    assert bus.encode(frame, 'RGB', 1.0, 80) is None
+    assert not bus.running
+    assert bus.encode(frame, 'RGB', 1.0, 80) is None
+    assert time.time() - started < 1
+
+
+def test_output_ring_is_smaller_than_input_ring():
+    bus = main.FrameBus(1, slot_bytes=1024 * 1024, output_slot_bytes=64 * 1024)
+    try:
+        assert bus.output_ring.slot_bytes == 64 * 1024
+        # 编码结果放不下输出槽位时返回 None，由调用方在本进程内编码
+        noise = np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+        assert bus.encode(noise, 'RGB', 1.0, 95) is None
+        assert bus.encode(np.zeros((120, 160, 3), dtype=np.uint8), 'RGB', 1.0, 80) is not None
+    finally:
+        bus.close()
+
+
+def test_tile_stream_is_encoded_by_workers(synthetic_desktop, monkeypatch):
+    frame = np.asarray(synthetic_desktop.grab().convert('RGB'))
+    expected = main.TileEncoder().encode_frame(frame, {}, 80)
+    bus = main.FrameBus(1, slot_bytes=frame.nbytes)
+    monkeypatch.setattr(main, 'frame_bus', bus)
+    encoded = []
+    original = main.encode_tile_data
+    monkeypatch.setattr(main, 'encode_tile_data', lambda *args: encoded.append(args) or original(*args))
+    try:
+        assert main.TileEncoder().encode_frame(frame, {}, 80) == expected
+    finally:
+        bus.close()
+    # 所有图块都在工作进程中编码，服务进程内没有编码
+    assert encoded == []
@@ -0,0 +1,219 @@
+import http.client
+import io
+import socket
+import sys
+import threading
+import time
+
+import pytest
+from werkzeug.serving import make_server
+
+import main
+
+
+@pytest.fixture
+def agent_url():
+    server = make_server('127.0.0.1', 0, main.app, threaded=True, request_handler=main.KeepAliveRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.port}"
+    server.shutdown()
+
+
+def test_pool_reuses_agent_connections(agent_url):
+    pool = main.UpstreamConnectionPool(agent_url)
+    status, _, _ = pool.request('GET', '/server_time')
+    assert status == 200
+    connection = pool.idle.queue[0]
+    for _ in range(5):
+        status, content_type, _ = pool.request('GET', '/server_time')
+        assert status == 200
+        assert content_type == 'application/json'
+    assert pool.idle.qsize() == 1
+    assert pool.idle.queue[0] is connection
+
+
+def test_unread_request_body_does_not_break_reused_connection(agent_url):
+    pool = main.UpstreamConnectionPool(agent_url)
+    # 只允许 GET 的路由不会读取请求体，服务端必须在处理下一个请求前读完它
+    status, _, _ = pool.request('POST', '/server_time', body=b'x' * 100000,
+                                headers={'Content-Type': 'application/octet-stream'})
+    assert status == 405
+    connection = pool.idle.queue[0]
+    status, _, _ = pool.request('GET', '/server_time')
+    assert status == 200
+    assert pool.idle.queue[0] is connection
+
+
+def test_streaming_response_closes_connection(agent_url, synthetic_desktop):
+    pool = main.UpstreamConnectionPool(agent_url)
+    connection = pool.connect()
+    connection.request('GET', '/video_stream')
+    response = connection.getresponse()
+    assert response.getheader('Transfer-Encoding') == 'chunked'
+    assert response.will_close
+    connection.close()
+
+
+def test_stale_idle_connection_is_replaced(agent_url):
+    # 被控端已关闭的空闲连接: 请求发出后没有收到任何响应数据，换新连接重试
+    listener = socket.create_server(('127.0.0.1', 0))
+    stale = http.client.HTTPConnection('127.0.0.1', listener.getsockname()[1])
+    stale.connect()
+    listener.accept()[0].close()
+    listener.close()
+    pool = main.UpstreamConnectionPool(agent_url)
+    pool.idle.put(stale)
+    status, _, _ = pool.request('GET', '/server_time')
+    assert status == 200
+
+
+def test_timed_out_request_is_not_retried():
+    calls = []
+
+    def slow_agent(environ, start_response):
+        calls.append(environ['PATH_INFO'])
+        if environ['PATH_INFO'] == '/slow':
+            time.sleep(1)
+        start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', '2')])
+        return [b'ok']
+
+    server = make_server('127.0.0.1', 0, slow_agent, threaded=True, request_handler=main.KeepAliveRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        pool = main.UpstreamConnectionPool(f"http://127.0.0.1:{server.port}")
+        assert pool.request('GET', '/fast')[0] == 200
+        # 复用的连接上读取超时，被控端可能已执行了请求，不能再发送一次
+        with pytest.raises(TimeoutError):
+            pool.request('POST', '/slow', body=b'{}', timeout=0.3)
+        time.sleep(1)
+        assert calls == ['/fast', '/slow']
+    finally:
+        server.shutdown()
+
+
+@pytest.fixture
+def gateway(agent_url, synthetic_desktop, monkeypatch):
+    agent = main.AgentUpstream(agent_url)
+    monkeypatch.setattr(main, 'gateway_agents', [agent])
+    yield main.gateway_app.test_client()
+    agent.snapshot.unsubscribe()
+
+
+def test_long_running_command_is_not_cut_off_by_default_timeout(gateway, monkeypatch):
+    monkeypatch.setattr(main, 'GATEWAY_REQUEST_TIMEOUT', 0.3)
+    monkeypatch.setitem(main.GATEWAY_ROUTE_TIMEOUTS, 'execute_command', 10)
+    command = f'"{sys.executable}" -c "import time; time.sleep(1); print(42)"'
+    response = gateway.post('/agents/0/execute_command', json={'command': command})
+    assert response.status_code == 200
+    assert response.get_json()['输出'].strip() == '42'
+    # 其他路由仍使用默认超时
+    monkeypatch.setitem(main.GATEWAY_ROUTE_TIMEOUTS, 'execute_command', 0.3)
+    assert gateway.post('/agents/0/execute_command', json={'command': command}).status_code == 502
+
+
+def test_large_upload_is_streamed_to_agent(gateway, monkeypatch, tmp_path):
+    monkeypatch.setitem(main.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr(main, 'GATEWAY_BUFFER_BYTES', 1024)
+    pool = main.gateway_agents[0].pool
+    bodies = []
+    original_open = pool.open
+    monkeypatch.setattr(pool, 'open', lambda method, path, body=None, *args, **kwargs:
+                        bodies.append(body) or original_open(method, path, body, *args, **kwargs))
+    data = bytes(range(256)) * 4096
+    response = gateway.post('/agents/0/upload_file', data={'file': (io.BytesIO(data), 'big.bin')})
+    assert response.status_code == 200
+    assert (tmp_path / 'big.bin').read_bytes() == data
+    # 网关把请求体作为流交给上游连接，没有先读入内存
+    assert len(bodies) == 1 and not isinstance(bodies[0], bytes)
+
+
+def test_streamed_response_keeps_length_and_returns_connection(gateway):
+    pool = main.gateway_agents[0].pool
+    for _ in range(3):
+        response = gateway.get('/agents/0/server_time')
+        assert response.status_code == 200
+        assert response.headers['Content-Length'] == str(len(response.get_data()))
+    # 响应体转发完后连接归还连接池，之后的请求复用同一个连接
+    assert pool.idle.qsize() == 1
+
+
+def test_wall_uses_thumbnails_instead_of_streams(gateway):
+    page = gateway.get('/').get_data(as_text=True)
+    assert 'src="/agents/0/thumbnail"' in page
+    assert 'snapshot_stream' not in page
+    deadline = time.time() + 5
+    response = gateway.get('/agents/0/thumbnail')
+    while response.status_code == 503 and time.time() < deadline:
+        time.sleep(0.1)
+        response = gateway.get('/agents/0/thumbnail')
+    assert response.status_code == 200
+    assert response.data[:3] == b'\xff\xd8\xff'
+
+
+@pytest.mark.parametrize('event_stream, keepalive', [(False, b'\r\n'), (True, b': keepalive\n\n')])
+def test_relay_writes_keepalive_while_upstream_is_down(monkeypatch, event_stream, keepalive):
+    monkeypatch.setattr(main, 'GATEWAY_KEEPALIVE_SECONDS', 0.1)
+    listener = socket.create_server(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    relay = main.StreamRelay(main.UpstreamConnectionPool(f"http://127.0.0.1:{port}"), '/video_stream', event_stream)
+    messages = relay.generate_messages()
+    started = time.time()
+    assert next(messages) == keepalive
+    assert time.time() - started < 2
+    # 写出保活数据时才能发现操作者已断开，关闭生成器后退订
+    messages.close()
+    assert relay.subscribers == 0
+
+
+def serve_counting_agent(requests):
+    def counting_agent(environ, start_response):
+        requests.append(environ['PATH_INFO'])
+        return main.app(environ, start_response)
+
+    server = make_server('127.0.0.1', 0, counting_agent, threaded=True, request_handler=main.KeepAliveRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def read_first_message(response):
+    if response.getheader('Content-Type').startswith('text/event-stream'):
+        return response.readline()
+    while response.readline().strip() != b'--frame':
+        pass
+    return response.readline()
+
+
+def test_each_agent_stream_has_one_upstream_connection(synthetic_desktop, monkeypatch):
+    agent_requests = [[], []]
+    agents = [serve_counting_agent(requests) for requests in agent_requests]
+    monkeypatch.setattr(main, 'gateway_agents', [main.AgentUpstream(f"http://127.0.0.1:{agent.port}")
+                                                 for agent in agents])
+    gateway = make_server('127.0.0.1', 0, main.gateway_app, threaded=True,
+                          request_handler=main.KeepAliveRequestHandler)
+    threading.Thread(target=gateway.serve_forever, daemon=True).start()
+    operators = []
+    try:
+        # 每个被控端的视频流和光标流各有三个操作者同时观看
+        for index in range(2):
+            for route in ('video_stream', 'cursor_stream'):
+                for _ in range(3):
+                    connection = http.client.HTTPConnection('127.0.0.1', gateway.port, timeout=10)
+                    connection.request('GET', f'/agents/{index}/{route}')
+                    response = connection.getresponse()
+                    assert response.status == 200
+                    assert read_first_message(response)
+                    operators.append(connection)
+        for agent, requests in zip(main.gateway_agents, agent_requests):
+            assert requests.count('/video_stream') == 1
+            assert requests.count('/cursor_stream') == 1
+            assert agent.status()['viewers'] == {'/video_stream': 3, '/cursor_stream': 3}
+    finally:
+        for connection in operators:
+            connection.close()
+        for agent in main.gateway_agents:
+            agent.snapshot.unsubscribe()
+        gateway.shutdown()
+        for agent in agents:
+            agent.shutdown()
@@ -0,0 +1,102 @@
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def client(synthetic_desktop, monkeypatch):
+    monkeypatch.setattr(main, 'SCREEN_FRAME_RATE', 1000)
+    main.latency_probe.reset()
+    yield main.app.test_client()
+    main.latency_probe.reset()
+
+
+def deliver_frames(stream, count=2):
+    # 探测在截图时被检测到，在生成器恢复(帧已发送)时记录发送阶段
+    for _ in range(count):
+        next(stream)
+
+
+@pytest.mark.parametrize('stream_factory', [main.generate_screen_frames, main.generate_screen_tiles])
+def test_probes_record_every_stage(client, stream_factory):
+    stream = stream_factory()
+    deliver_frames(stream)
+    response = client.post('/mouse_click', json={
+        'x': 200, 'y': 200, 'scale_x': 1, 'scale_y': 1, 'click_type': '左键',
+        'probe': {'id': 'click', 'sent_at': time.time() * 1000}
+    })
+    assert response.status_code == 200
+    deliver_frames(stream)
+    response = client.post('/keyboard_press', json={
+        'key': 'a', 'probe': {'id': 'key', 'sent_at': time.time() * 1000, 'region': [0, 680, 1280, 40]}
+    })
+    assert response.status_code == 200
+    deliver_frames(stream)
+    stream.close()
+
+    stats = client.get('/latency_stats').get_json()
+    assert stats['pending'] == 0
+    assert stats['timeouts'] == 0
+    assert [sample['id'] for sample in stats['recent']] == ['click', 'key']
+    for stage in main.LatencyProbe.STAGES:
+        assert stats['histograms'][stage]['count'] == 2, stage
+        assert all(stage in sample for sample in stats['recent'])
+
+
+@pytest.mark.parametrize('probe', [
+    {'id': 'short', 'region': [0, 0, 10]},
+    {'id': 'text', 'region': 'abcd'},
+    {'id': 'empty', 'region': [0, 0, 0, 10]},
+    {'id': 'clock', 'sent_at': 'yesterday'},
+    {'id': 'nulls', 'region': [None, 0, 10, 10]},
+])
+def test_invalid_probe_still_injects_input(client, synthetic_desktop, probe):
+    desktop = synthetic_desktop
+    response = client.post('/mouse_click', json={
+        'x': 100, 'y': 100, 'scale_x': 1, 'scale_y': 1, 'click_type': '左键', 'probe': probe
+    })
+    assert response.status_code == 200
+    assert desktop.marks == 1
+    response = client.post('/keyboard_press', json={'key': 'a', 'probe': probe})
+    assert response.status_code == 200
+    assert desktop.caret == 20
+    assert client.get('/latency_stats').get_json()['pending'] == 0
+
+
+def test_pending_probes_are_bounded_without_a_viewer(client, monkeypatch):
+    for index in range(main.LATENCY_PROBE_MAX_PENDING * 2):
+        client.post('/keyboard_press', json={'key': 'a', 'probe': {'id': f'key-{index}'}})
+    stats = client.get('/latency_stats').get_json()
+    assert stats['pending'] == main.LATENCY_PROBE_MAX_PENDING
+    assert stats['timeouts'] == main.LATENCY_PROBE_MAX_PENDING
+
+    # 超时的探测在下一次注入时被清理
+    monkeypatch.setattr(main, 'LATENCY_PROBE_TIMEOUT', 0)
+    time.sleep(0.01)
+    client.post('/keyboard_press', json={'key': 'a', 'probe': {'id': 'latest'}})
+    assert client.get('/latency_stats').get_json()['pending'] == 1
+
+
+def test_click_probe_near_the_edge_is_detected(client):
+    stream = main.generate_screen_frames()
+    deliver_frames(stream)
+    response = client.post('/mouse_click', json={
+        'x': 2, 'y': 715, 'scale_x': 1, 'scale_y': 1, 'click_type': '左键', 'probe': {'id': 'corner'}
+    })
+    assert response.status_code == 200
+    deliver_frames(stream)
+    stream.close()
+    stats = client.get('/latency_stats').get_json()
+    assert [sample['id'] for sample in stats['recent']] == ['corner']
+    assert stats['timeouts'] == 0
+
+
+def test_slow_percentiles_report_the_overflow_bucket():
+    histogram = main.LatencyHistogram(buckets=(10, 100))
+    for value in (5, 50, 500, 600):
+        histogram.observe(value)
+    stats = histogram.to_dict()
+    assert stats['p50'] == 100
+    assert stats['p90'] == '>100'
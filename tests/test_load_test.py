@@ -0,0 +1,32 @@
+import argparse
+import socket
+
+import main
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_load_test_smoke(tmp_path, capsys):
+    report_path = tmp_path / 'report.json'
+    args = argparse.Namespace(target=None, port=free_port(), viewers=2, camera_viewers=0, slow_viewers=1,
+                              slow_read_delay=0.2, senders=1, event_rate=10, duration=2, report=str(report_path))
+    report = main.run_load_test(args)
+
+    assert report_path.exists()
+    assert [viewer['slow'] for viewer in report['viewers']] == [True, False]
+    for viewer in report['viewers']:
+        assert viewer['path'] == '/video_stream'
+        assert viewer['frames'] > 0
+        assert viewer['fps'] > 0
+        assert set(viewer['frame_gap_ms']) == {'p50', 'p90', 'p99', 'max'}
+    # 慢速客户端只拿最新帧，收到的帧更少
+    assert report['viewers'][0]['frames'] < report['viewers'][1]['frames']
+    sender, = report['senders']
+    assert sender['requests'] > 0
+    assert sender['errors'] == 0
+    assert set(sender['latency_ms']) == {'p50', 'p90', 'p99', 'max'}
+    assert set(report['server']) == {'cpu_percent', 'rss_mb', 'threads'}
@@ -0,0 +1,59 @@
+import json
+import struct
+
+import numpy as np
+
+import main
+
+
+def parse_message(message):
+    header_length = struct.unpack('>I', message[:4])[0]
+    return json.loads(message[4:4 + header_length])
+
+
+def desktop_frame(desktop):
+    return np.asarray(desktop.grab().convert('RGB'))
+
+
+def test_text_tiles_are_lossless_and_photo_tiles_are_jpeg(synthetic_desktop):
+    encoder = main.TileEncoder()
+    text = desktop_frame(synthetic_desktop)[:main.TILE_SIZE, :main.TILE_SIZE]
+    photo = np.random.default_rng(0).integers(0, 256, text.shape, dtype=np.uint8)
+    assert encoder.encode_tile(text, encoder.tile_digest(text), 80)[0] == 'png'
+    assert encoder.encode_tile(photo, encoder.tile_digest(photo), 80)[0] == 'jpeg'
+
+
+def test_only_changed_tiles_are_sent(synthetic_desktop):
+    encoder = main.TileEncoder()
+    sent_tiles = {}
+    first = parse_message(encoder.encode_frame(desktop_frame(synthetic_desktop), sent_tiles, 80))
+    assert len(first['tiles']) == 10 * 6
+    assert encoder.encode_frame(desktop_frame(synthetic_desktop), sent_tiles, 80) is None
+
+    synthetic_desktop.click(300, 300)
+    changed = parse_message(encoder.encode_frame(desktop_frame(synthetic_desktop), sent_tiles, 80))
+    assert [tile[:2] for tile in changed['tiles']] == [[256, 256]]
+
+    # 新客户端需要完整画面，图块直接来自共享缓存
+    assert len(parse_message(encoder.encode_frame(desktop_frame(synthetic_desktop), {}, 80))['tiles']) == 60
+
+
+def test_tiles_the_client_has_are_not_reencoded_after_eviction(synthetic_desktop, monkeypatch):
+    encoder = main.TileEncoder(max_entries=1)
+    sent_tiles = {}
+    frame = desktop_frame(synthetic_desktop)
+    encoder.encode_frame(frame, sent_tiles, 80)
+    encoded = []
+    original = main.encode_tile_data
+    monkeypatch.setattr(main, 'encode_tile_data', lambda *args: encoded.append(args) or original(*args))
+    assert encoder.encode_frame(frame, sent_tiles, 80) is None
+    assert encoded == []
+
+
+def test_tile_stream_encodes_at_native_resolution(synthetic_desktop, monkeypatch):
+    monkeypatch.setattr(main, 'SCREEN_RESOLUTION_SCALE', 0.5)
+    monkeypatch.setattr(main, 'SCREEN_VIEWPORT', None)
+    stream = main.generate_screen_tiles()
+    header = parse_message(next(stream))
+    stream.close()
+    assert (header['width'], header['height']) == (1280, 720)
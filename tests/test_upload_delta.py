@@ -0,0 +1,114 @@
+import argparse
+import hashlib
+import io
+import json
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+import main
+
+
+@pytest.fixture
+def upload_folder(monkeypatch, tmp_path):
+    monkeypatch.setitem(main.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    main.signature_cache.cache.clear()
+    return tmp_path
+
+
+def post_delta(client, path, recipe, data=b'', expected=b''):
+    return client.post('/upload_delta', data={
+        'path': path,
+        'block_size': '1024',
+        'recipe': json.dumps(recipe),
+        'sha256': hashlib.sha256(expected).hexdigest(),
+        'data': (io.BytesIO(data), 'data')
+    })
+
+
+def test_delta_reuses_blocks_of_the_old_file(upload_folder):
+    old = bytes(range(256)) * 16
+    (upload_folder / 'f.bin').write_bytes(old)
+    new = old[:2048] + b'changed' + old[2048:]
+    response = post_delta(main.app.test_client(), 'f.bin', [['copy', 0, 2], ['data', 7], ['copy', 2, 2]],
+                          data=b'changed', expected=new)
+    assert response.status_code == 200
+    assert response.get_json()['复用字节'] == 4096
+    assert (upload_folder / 'f.bin').read_bytes() == new
+
+
+@pytest.mark.parametrize('recipe', [
+    5, None, [1], [[]], [['copy', -1, 1]], [['copy', 0, 0]], [['copy', '0', 1]], [['copy', 0, 1, 2]],
+    [['data', -3]], [['data', 1.5]], [['data', True]], [['move', 0, 1]],
+])
+def test_malformed_recipe_is_rejected(upload_folder, recipe):
+    (upload_folder / 'f.bin').write_bytes(b'x' * 4096)
+    response = post_delta(main.app.test_client(), 'f.bin', recipe)
+    assert response.status_code == 400
+    assert sorted(entry.name for entry in upload_folder.iterdir()) == ['f.bin']
+
+
+def test_directory_target_is_rejected(upload_folder):
+    (upload_folder / 'folder').mkdir()
+    response = post_delta(main.app.test_client(), 'folder', [['data', 3]], data=b'abc', expected=b'abc')
+    assert response.status_code == 400
+    assert sorted(entry.name for entry in upload_folder.iterdir()) == ['folder']
+
+
+def test_failed_reconstruction_leaves_no_temporary_file(upload_folder):
+    response = post_delta(main.app.test_client(), 'f.bin', [['data', 3]], data=b'abc', expected=b'abd')
+    assert response.status_code == 400
+    assert list(upload_folder.iterdir()) == []
+
+
+def serve(wsgi_app):
+    server = make_server('127.0.0.1', 0, wsgi_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def push_args(server, local, remote_name):
+    return argparse.Namespace(target=f"http://127.0.0.1:{server.port}", port=None, push=str(local),
+                              remote_name=remote_name, block_size=1024)
+
+
+def test_push_file_round_trip(upload_folder, tmp_path_factory):
+    local = tmp_path_factory.mktemp('local') / 'f.bin'
+    local.write_bytes(bytes(range(256)) * 20)
+    server = serve(main.app)
+    try:
+        result = main.push_file(push_args(server, local, 'f.bin'))
+    finally:
+        server.shutdown()
+    assert result['传输字节'] == 5120
+    assert (upload_folder / 'f.bin').read_bytes() == local.read_bytes()
+
+
+def test_push_file_exits_when_delta_is_rejected(upload_folder, tmp_path_factory):
+    (upload_folder / 'folder').mkdir()
+    local = tmp_path_factory.mktemp('local') / 'f.bin'
+    local.write_bytes(b'abc')
+    server = serve(main.app)
+    try:
+        with pytest.raises(SystemExit) as exit_info:
+            main.push_file(push_args(server, local, 'folder'))
+    finally:
+        server.shutdown()
+    assert exit_info.value.code == 1
+
+
+def test_push_file_exits_on_non_json_error_page(tmp_path):
+    def bad_gateway(environ, start_response):
+        start_response('502 Bad Gateway', [('Content-Type', 'text/html')])
+        return [b'<html><body>Bad Gateway</body></html>']
+
+    local = tmp_path / 'f.bin'
+    local.write_bytes(b'abc')
+    server = serve(bad_gateway)
+    try:
+        with pytest.raises(SystemExit) as exit_info:
+            main.push_file(push_args(server, local, 'f.bin'))
+    finally:
+        server.shutdown()
+    assert exit_info.value.code == 1
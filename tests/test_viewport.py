@@ -0,0 +1,79 @@
+import json
+import struct
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def client(synthetic_desktop, monkeypatch):
+    monkeypatch.setattr(main, 'SCREEN_VIEWPORT', None)
+    return main.app.test_client()
+
+
+@pytest.mark.parametrize('monitor', [-1, 1, 'first', None, [0]])
+def test_invalid_monitor_is_rejected(client, monitor):
+    assert client.post('/set_viewport', json={'monitor': monitor}).status_code == 400
+    assert main.SCREEN_VIEWPORT is None
+
+
+def test_monitor_selects_its_bounds(client):
+    assert client.post('/set_viewport', json={'monitor': 0}).status_code == 200
+    assert main.SCREEN_VIEWPORT == (0, 0, 1280, 720)
+
+
+@pytest.mark.parametrize('viewport', [
+    {'x': None, 'y': 0, 'width': 10, 'height': 10},
+    {'x': [1], 'y': 0, 'width': 10, 'height': 10},
+    {'x': 0, 'y': 0, 'width': 0, 'height': 10},
+    {'x': 2000, 'y': 0, 'width': 100, 'height': 100},
+    {'x': -500, 'y': -500, 'width': 100, 'height': 100},
+])
+def test_invalid_rectangle_is_rejected(client, viewport):
+    assert client.post('/set_viewport', json=viewport).status_code == 400
+    assert main.SCREEN_VIEWPORT is None
+
+
+def test_rectangle_is_clamped_to_the_desktop(client):
+    response = client.post('/set_viewport', json={'x': -100, 'y': 600, 'width': 400, 'height': 400})
+    assert response.status_code == 200
+    assert main.SCREEN_VIEWPORT == (0, 600, 300, 120)
+    assert response.get_json()['viewport'] == {'x': 0, 'y': 600, 'width': 300, 'height': 120}
+
+
+def test_each_stream_has_its_own_viewport(client, synthetic_desktop):
+    zoomed = main.generate_screen_tiles((100, 50, 256, 128))
+    full = main.generate_screen_tiles()
+    assert parse_tile_header(next(zoomed))[:2] == (256, 128)
+    assert parse_tile_header(next(full))[:2] == (1280, 720)
+    zoomed.close()
+    full.close()
+    assert main.SCREEN_VIEWPORT is None
+
+
+@pytest.mark.parametrize('route', ['/video_stream', '/screen_tile_stream'])
+def test_invalid_stream_viewport_is_rejected(client, route):
+    assert client.get(f'{route}?x=5000&y=0&width=10&height=10').status_code == 400
+    assert client.get(f'{route}?monitor=-1').status_code == 400
+
+
+def test_click_is_mapped_with_the_clients_viewport(client, synthetic_desktop):
+    # 默认区域被其他客户端修改后，按客户端自己的查看区域换算点击坐标
+    client.post('/set_viewport', json={'x': 600, 'y': 300, 'width': 100, 'height': 100})
+    response = client.post('/mouse_click', json={
+        'x': 10, 'y': 20, 'scale_x': 2, 'scale_y': 2, 'click_type': '左键',
+        'viewport': {'x': 100, 'y': 50, 'width': 256, 'height': 128}
+    })
+    assert response.status_code == 200
+    assert synthetic_desktop.position() == (120, 90)
+    response = client.post('/mouse_click', json={
+        'x': 10, 'y': 20, 'scale_x': 1, 'scale_y': 1, 'click_type': '左键', 'viewport': {'x': 'left'}
+    })
+    assert response.status_code == 400
+
+
+def parse_tile_header(message):
+    header_length = struct.unpack('>I', message[:4])[0]
+    header = json.loads(message[4:4 + header_length])
+    return header['width'], header['height']